@@ -0,0 +1,309 @@
+#
+# Benchmarks
+#
+# Generates synthetic projects and times complete concatenations of them, the same way the
+# command line tool builds them:
+#
+#     python bench/benchmark.py                          # all scenarios
+#     python bench/benchmark.py diamond deep_chain --scale 4 --repeat 5
+#     python bench/benchmark.py --incremental            # also time rebuilds with the dependency graph
+#     python bench/benchmark.py --json results.json      # keep the results, e.g. to compare branches
+#
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+# Not available in Python 2, peak memory is not measured there
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_concatenator import core
+from file_concatenator import cli
+from file_concatenator import settings as settings_files
+
+# Settings used for every scenario, on top of the plugin's defaults
+BENCH_SETTINGS = {
+	'verbose':               False,
+	'background_build':      False,
+	'incremental_build':     False,
+	'rebuild_roots_on_save': False,
+	'build_manifest':        False,
+	'profile':               False
+}
+
+HEAVY_HEADER = '/**! BOF {{system.date}} {{system.time}}: {{this.realpath}} ({{this.filesize}}), referer: {{referer.filename}}, source: {{source.filename}}, last modified {{this.lastmod_date}} {{this.lastmod_time}} */\n'
+HEAVY_FOOTER = '\n/**! EOF {{this.filename}} ({{this.fileroot}}.{{this.extension}}) in {{this.dirname}} */\n\n'
+
+def write_file (path, content):
+	dirname = os.path.dirname(path)
+
+	if not os.path.isdir(dirname):
+		os.makedirs(dirname)
+
+	with open(path, 'w') as handle:
+		handle.write(content)
+
+# Some lines of code
+def filler (name, lines):
+	return ''.join('var %s_%d = function (a, b) { return a + b + %d; };\n' % (name, line, line) for line in range(lines))
+
+#
+# Scenarios
+#
+# Each writes a project to directory and returns the path of the file to concatenate, relative to it.
+#
+
+# One file importing many small files through a glob
+def wide_glob (directory, scale):
+	for index in range(2000 * scale):
+		write_file(os.path.join(directory, 'components', 'c%05d.js' % index), filler('c%d' % index, 20))
+
+	write_file(os.path.join(directory, 'main.js'), "@import('glob:components/*.js')\n")
+
+	return 'main.js'
+
+# Every file imports the next one
+def deep_chain (directory, scale):
+	depth = 100 * scale
+
+	for index in range(depth):
+		write_file(os.path.join(directory, 'f%d.js' % index), filler('f%d' % index, 10) + "@import('f%d.js')\n" % (index + 1))
+
+	write_file(os.path.join(directory, 'f%d.js' % depth), filler('leaf', 10))
+
+	return 'f0.js'
+
+# Layers of two files, both importing both files of the next layer: the same files are imported over and over
+def diamond (directory, scale):
+	layers = 12 + scale
+
+	for layer in range(layers):
+		for side in 'ab':
+			write_file(os.path.join(directory, 'l%d%s.js' % (layer, side)), filler('l%d%s' % (layer, side), 5) + "@import('l%da.js')\n@import('l%db.js')\n" % (layer + 1, layer + 1))
+
+	for side in 'ab':
+		write_file(os.path.join(directory, 'l%d%s.js' % (layers, side)), filler('leaf' + side, 5))
+
+	write_file(os.path.join(directory, 'main.js'), "@import('l0a.js')\n@import('l0b.js')\n")
+
+	return 'main.js'
+
+# A few large files, one of them with a method at its very end
+def big_leaf (directory, scale):
+	imports = []
+
+	for index in range(4):
+		content = filler('big%d' % index, 40000 * scale)
+
+		if index == 3:
+			content += "@option('trim_children', 'false')\n"
+
+		write_file(os.path.join(directory, 'vendor', 'big%d.js' % index), content)
+		imports.append("@import('vendor/big%d.js')\n" % index)
+
+	write_file(os.path.join(directory, 'main.js'), ''.join(imports))
+
+	return 'main.js'
+
+# Many files with @option's, recursive ones included, each scoping settings to its own subtree
+def option_scopes (directory, scale):
+	groups = 20 * scale
+
+	for group in range(groups):
+		children = []
+
+		for index in range(25):
+			write_file(os.path.join(directory, 'g%d' % group, 'c%d.js' % index), "@option('trim_children', 'false')\n" + filler('c%d' % index, 5))
+			children.append("@import('c%d.js')\n" % index)
+
+		write_file(os.path.join(directory, 'g%d' % group, 'group.js'), "@option('tpl_child_footer', '\\n/* end {{this.filename}} */\\n', true)\n@option('apply_intendation', 'false')\n" + ''.join(children))
+
+	write_file(os.path.join(directory, 'main.js'), ''.join("@import('g%d/group.js')\n" % group for group in range(groups)))
+
+	return 'main.js'
+
+# Many small files with long headers and footers
+def heavy_templates (directory, scale):
+	for index in range(1000 * scale):
+		write_file(os.path.join(directory, 'parts', 'p%05d.js' % index), filler('p%d' % index, 2))
+
+	write_file(os.path.join(directory, 'main.js'), "@import('glob:parts/*.js')\n")
+
+	return 'main.js'
+
+# Imports nested in indented @import's
+def indented (directory, scale):
+	depth = 20
+
+	for index in range(depth):
+		write_file(os.path.join(directory, 'i%d.js' % index), filler('i%d' % index, 5) + "    @import('i%d.js')\n" % (index + 1))
+
+	write_file(os.path.join(directory, 'i%d.js' % depth), filler('leaf', 20000 * scale))
+
+	return 'i0.js'
+
+# (name, function, settings)
+SCENARIOS = [
+	('wide_glob',       wide_glob,       {}),
+	('deep_chain',      deep_chain,      {}),
+	('diamond',         diamond,         {}),
+	('big_leaf',        big_leaf,        {}),
+	('option_scopes',   option_scopes,   {}),
+	('heavy_templates', heavy_templates, {'tpl_child_header': HEAVY_HEADER, 'tpl_child_footer': HEAVY_FOOTER}),
+	('indented',        indented,        {})
+]
+
+# Returns the number of files and their total size in directory
+def measure_tree (directory):
+	files = 0
+	size  = 0
+
+	for dirpath, dirnames, filenames in os.walk(directory):
+		for filename in filenames:
+			files += 1
+			size  += os.path.getsize(os.path.join(dirpath, filename))
+
+	return files, size
+
+# Concatenates root once. Returns (seconds, result)
+def build (root, settings, cache_dir):
+	host  = cli.CliHost(settings, cache_dir)
+	start = time.time()
+
+	result = core.Concatenator(host).concatenate(root)
+
+	seconds = time.time() - start
+
+	if host.errors:
+		raise RuntimeError('\n'.join(host.messages))
+
+	return seconds, result
+
+def run_scenario (name, generate, scenario_settings, args):
+	directory = tempfile.mkdtemp(prefix = 'fc-bench-')
+
+	try:
+		root = os.path.join(directory, generate(directory, args.scale))
+		files, size_in = measure_tree(directory)
+
+		settings = settings_files.load_settings([settings_files.DEFAULT_SETTINGS_FILE])
+		settings.update(BENCH_SETTINGS)
+		settings.update(scenario_settings)
+
+		times = []
+
+		for repeat in range(args.repeat):
+			seconds, result = build(root, settings, None)
+			times.append(seconds)
+
+		size_out = sum(os.path.getsize(file_dict['output_realpath']) for file_dict in result['written_file_dicts'])
+
+		report = {
+			'scenario': name,
+			'files':    files,
+			'bytes_in': size_in,
+			'bytes_out': size_out,
+			'best':     min(times),
+			'median':   sorted(times)[len(times) // 2]
+		}
+
+		# Builds reusing the dependency graph of the first one, nothing having changed
+		if args.incremental:
+			cache_dir = os.path.join(directory, '.cache')
+			settings.update({'incremental_build': True})
+			core.dependency_graph = None
+
+			build(root, settings, cache_dir)
+			report['incremental'] = min(build(root, settings, cache_dir)[0] for repeat in range(args.repeat))
+
+			core.dependency_graph = None
+
+		# Measured separately, tracing allocations slows the build down
+		if tracemalloc:
+			settings.update({'incremental_build': False})
+			tracemalloc.start()
+
+			try:
+				build(root, settings, None)
+				report['peak_memory'] = tracemalloc.get_traced_memory()[1]
+			finally:
+				tracemalloc.stop()
+
+		return report
+	except (RuntimeError, EnvironmentError) as exc:
+		return {'scenario': name, 'error': '%s: %s' % (exc.__class__.__name__, str(exc).strip().split('\n')[-1])}
+	finally:
+		shutil.rmtree(directory, True)
+
+def format_report (report):
+	if 'error' in report:
+		return '%-16s failed, %s' % (report['scenario'], report['error'])
+
+	line = '%-16s %7d %10s %10s %8.3f %8.3f %9.1f %9.0f' % (
+		report['scenario'], report['files'], format_bytes(report['bytes_in']), format_bytes(report['bytes_out']),
+		report['best'], report['median'], report['bytes_out'] / report['best'] / 1024 / 1024, report['files'] / report['best'])
+
+	line += ' %10s' % (format_bytes(report['peak_memory']) if 'peak_memory' in report else '-')
+
+	if 'incremental' in report:
+		line += ' %11.3f' % report['incremental']
+
+	return line
+
+def format_bytes (size):
+	for unit in ['B', 'KB', 'MB', 'GB']:
+		if size < 1024.0:
+			return '%3.1f %s' % (size, unit)
+		size /= 1024.0
+	return '%3.1f %s' % (size, 'TB')
+
+def main (argv = None):
+	names = [name for name, generate, scenario_settings in SCENARIOS]
+
+	parser = argparse.ArgumentParser(description = 'Times concatenations of generated projects.')
+	parser.add_argument('scenarios', nargs = '*', metavar = 'scenario', help = 'scenarios to run: ' + ', '.join(names) + ' (default: all)')
+	parser.add_argument('--scale', type = int, default = 1, help = 'multiplies the size of the generated projects (default: %(default)s)')
+	parser.add_argument('--repeat', type = int, default = 3, help = 'number of timed builds per scenario (default: %(default)s)')
+	parser.add_argument('--incremental', action = 'store_true', help = 'also time rebuilds of unchanged projects with incremental_build')
+	parser.add_argument('--json', metavar = 'path', help = 'also write the results to this file')
+	args = parser.parse_args(argv)
+
+	for name in args.scenarios:
+		if not name in names:
+			parser.error('unknown scenario: ' + name)
+
+	header = '%-16s %7s %10s %10s %8s %8s %9s %9s %10s' % ('scenario', 'files', 'in', 'out', 'best s', 'median s', 'out MB/s', 'files/s', 'peak mem')
+
+	if args.incremental:
+		header += ' %11s' % 'incremental'
+
+	print(header)
+
+	reports = []
+
+	for name, generate, scenario_settings in SCENARIOS:
+		if args.scenarios and not name in args.scenarios:
+			continue
+
+		report = run_scenario(name, generate, scenario_settings, args)
+		reports.append(report)
+
+		print(format_report(report))
+		sys.stdout.flush()
+
+	if args.json:
+		with open(args.json, 'w') as handle:
+			json.dump({'scale': args.scale, 'repeat': args.repeat, 'python': sys.version.split()[0], 'results': reports}, handle, indent = 1)
+
+	return 1 if any('error' in report for report in reports) else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
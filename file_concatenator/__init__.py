@@ -0,0 +1,10 @@
+#
+# File Concatenator
+#
+# The engine behind the Sublime Text plugin (FileConcatenator.py), usable on its own:
+#
+#     from file_concatenator import core
+#     core.Concatenator(host).concatenate('/path/to/main.js')
+#
+# or from the command line, see cli.py.
+#
@@ -0,0 +1,171 @@
+#
+# Command line interface
+#
+# Builds files the same way the plugin does, without Sublime Text:
+#
+#     python -m file_concatenator build main.js css/main.css --jobs 4
+#     python -m file_concatenator watch main.js css/main.css
+#
+# Settings are read from the plugin's FileConcatenator.sublime-settings, then from the files given with
+# --settings (e.g. Packages/User/FileConcatenator.sublime-settings), then from --set key=value.
+#
+import os
+import sys
+import json
+import argparse
+import multiprocessing
+
+from . import core
+from . import settings as settings_files
+
+# Persistent caches are kept here unless --cache-dir is given
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'FileConcatenator')
+
+#
+# Host for builds started from the command line.
+# Messages are collected so that builds running in parallel don't mix their output.
+#
+class CliHost(core.Host):
+	def __init__ (self, settings, cache_dir):
+		core.Host.__init__(self, settings)
+
+		self.cache    = cache_dir
+		self.messages = []
+		self.errors   = 0
+
+	def cache_dir (self):
+		return self.cache
+
+	# There is nobody to ask; @saveto directories are created
+	def ok_cancel_dialog (self, message):
+		self.messages.append(message + '\n\n(Yes)')
+		return True
+
+	def error_message (self, message):
+		self.messages.append(message)
+		self.errors += 1
+
+	def message_dialog (self, message):
+		self.messages.append(message)
+
+	def status_message (self, message):
+		self.messages.append(message)
+
+# Returns the settings given on the command line
+def load_settings (args):
+	settings = settings_files.load_settings([settings_files.DEFAULT_SETTINGS_FILE] + (args.settings or []))
+
+	for assignment in args.set or []:
+		key, value = assignment.split('=', 1)
+
+		# Values are JSON, anything else is taken as a string
+		try:
+			value = json.loads(value)
+		except ValueError:
+			pass
+
+		settings.update({key: value})
+
+	return settings
+
+# Builds one file. Runs in the worker processes when building in parallel.
+# Returns (number of errors, messages)
+def build (job):
+	root, settings, cache_dir = job
+
+	host = CliHost(settings, cache_dir)
+
+	if not os.path.isfile(root):
+		return 1, ['No such file: ' + root]
+
+	core.Concatenator(host).concatenate(os.path.abspath(root))
+
+	return host.errors, host.messages
+
+def command_build (args):
+	settings  = load_settings(args)
+	cache_dir = None if args.no_cache else args.cache_dir
+
+	# Processes building in parallel would overwrite each other's dependency graph
+	if args.jobs > 1:
+		settings.update({'incremental_build': False})
+
+	jobs = [(root, settings, cache_dir) for root in args.roots]
+
+	if args.jobs > 1 and len(jobs) > 1:
+		pool = multiprocessing.Pool(min(args.jobs, len(jobs)))
+
+		try:
+			results = pool.map(build, jobs)
+		finally:
+			pool.close()
+			pool.join()
+	else:
+		results = [build(job) for job in jobs]
+
+	errors = 0
+
+	for (root, settings, cache_dir), (num_errors, messages) in zip(jobs, results):
+		errors += num_errors
+
+		for message in messages:
+			(sys.stderr if num_errors else sys.stdout).write(root + ': ' + message.strip() + '\n')
+
+	return 1 if errors else 0
+
+# Builds the roots, then again whenever anything they depend on changes. Runs until interrupted.
+def command_watch (args):
+	settings  = load_settings(args)
+	cache_dir = None if args.no_cache else args.cache_dir
+	host      = CliHost(settings, cache_dir)
+
+	def build_root (root):
+		result = core.Concatenator(host).concatenate(root)
+
+		for message in host.messages:
+			(sys.stderr if host.errors else sys.stdout).write(root + ': ' + message.strip() + '\n')
+
+		host.messages = []
+		host.errors   = 0
+
+		return core.result_paths(result) if result else []
+
+	watcher = core.Watcher(build_root, args.interval, args.debounce)
+
+	try:
+		watcher.run([os.path.abspath(root) for root in args.roots])
+	except KeyboardInterrupt:
+		pass
+
+	return 0
+
+# Arguments shared by all commands
+def add_arguments (parser):
+	parser.add_argument('roots', nargs = '+', metavar = 'file', help = 'file to concatenate, as if it was saved in Sublime Text')
+	parser.add_argument('--settings', action = 'append', metavar = 'path', help = 'settings file applied on top of the default settings, can be given more than once')
+	parser.add_argument('--set', action = 'append', metavar = 'key=value', help = 'setting applied on top of the settings files, value is JSON or a string')
+	parser.add_argument('--cache-dir', default = DEFAULT_CACHE_DIR, help = 'directory of the incremental build cache (default: %(default)s)')
+	parser.add_argument('--no-cache', action = 'store_true', help = 'do not keep an incremental build cache')
+
+def main (argv = None):
+	parser = argparse.ArgumentParser(prog = 'file_concatenator', description = 'Concatenates files as per their @import, @partof, @option and @saveto methods.')
+	commands = parser.add_subparsers(dest = 'command')
+
+	build_parser = commands.add_parser('build', help = 'concatenate files')
+	add_arguments(build_parser)
+	build_parser.add_argument('--jobs', '-j', type = int, default = 1, help = 'number of files to concatenate in parallel; disables incremental builds when above 1')
+	build_parser.set_defaults(run = command_build)
+
+	watch_parser = commands.add_parser('watch', help = 'concatenate files, and again whenever a file they depend on changes')
+	add_arguments(watch_parser)
+	watch_parser.add_argument('--interval', type = float, default = 0.5, help = 'seconds between checking the files for changes (default: %(default)s)')
+	watch_parser.add_argument('--debounce', type = float, default = 0.3, help = 'seconds without changes before building (default: %(default)s)')
+	watch_parser.set_defaults(run = command_watch)
+
+	args = parser.parse_args(argv)
+
+	if not getattr(args, 'run', None):
+		parser.print_help()
+		return 2
+
+	return args.run(args)
@@ -0,0 +1,2862 @@
+#
+# File Concatenator core
+#
+# The parser and everything it needs to build a concatenated file. Nothing in here depends on Sublime Text;
+# the plugin and the command line tool each hand the Concatenator a Host to talk to their surroundings.
+#
+import re
+import os
+import sys
+import time
+import errno
+import shutil
+import filecmp
+import fnmatch
+import json
+import hashlib
+import itertools
+import threading
+import traceback
+import collections
+
+from stat import S_ISREG, S_ISDIR
+
+from . import settings as settings_files
+
+# Not available in Python 2, reading ahead is disabled there
+try:
+	from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+	ThreadPoolExecutor = None
+
+# Not available before Python 3.5, directories are listed with os.listdir there
+try:
+	from os import scandir
+except ImportError:
+	scandir = None
+
+# Not available in Python 2.6 (Sublime 2), the in-memory expansion cache is disabled there
+try:
+	from collections import OrderedDict
+except ImportError:
+	OrderedDict = None
+
+# Not available in Python 2, timings fall back to the wall clock there
+clock = getattr(time, 'perf_counter', time.time)
+
+MESSAGE_HEADER  = 'Sublime File Concatenator\n===========================\n\n'
+
+MSG_TYPE = {}
+MSG_TYPE['INFO'] 	= 1
+MSG_TYPE['WARNING'] = 2
+MSG_TYPE['ERROR'] 	= 3
+MSG_TYPE['FATAL'] 	= 4
+
+# A logged event: its level (MSG_TYPE), the message as a format string, which identifies the event, the values to
+# format it with and the file it concerns. Records are formatted only when displayed, see Concatenator.format_log_entry
+LogRecord = collections.namedtuple('LogRecord', ['level', 'message', 'args', 'filename'])
+
+# Number of log records kept per concatenation. Older records are dropped first, but are still counted.
+LOG_RECORD_LIMIT = 2000
+
+# Settings which affect the expanded output of a file. A cached expansion
+# is only reused if all of these resolve to the same values as when it was made.
+OUTPUT_SETTING_KEYS = (
+	'apply_intendation',
+	'trim_parents',
+	'trim_children',
+	'write_nested_parents',
+	'date_format',
+	'time_format',
+	'tpl_parent_header',
+	'tpl_parent_footer',
+	'tpl_child_header',
+	'tpl_child_footer'
+)
+
+#
+# Host
+#
+# Everything the Concatenator needs from the program it runs in: settings, a cache directory and a way
+# to talk to the user. This one has no cache and keeps quiet; see the plugin and the command line tool.
+#
+class Host(object):
+	# settings is anything with get() and has(), by default the settings shipped with the plugin
+	def __init__ (self, settings = None):
+		self.snapshot = SettingsSnapshot(settings) if settings else None
+
+	# Returns a SettingsSnapshot
+	def settings (self):
+		if self.snapshot is None:
+			self.snapshot = SettingsSnapshot(settings_files.load_settings([settings_files.DEFAULT_SETTINGS_FILE]))
+
+		return self.snapshot
+
+	# Returns the directory used for persistent caches (dependency graph etc), or None to not keep any
+	def cache_dir (self):
+		return None
+
+	def ok_cancel_dialog (self, message):
+		return True
+
+	def error_message (self, message):
+		pass
+
+	def message_dialog (self, message):
+		pass
+
+	def status_message (self, message):
+		pass
+
+	# Values of {{system.platform}}, {{system.arch}} and {{system.version}}
+	def platform (self):
+		if sys.platform.startswith('win'):
+			return 'windows'
+
+		return 'osx' if sys.platform == 'darwin' else 'linux'
+
+	def arch (self):
+		return 'x64' if sys.maxsize > 2 ** 32 else 'x32'
+
+	def version (self):
+		return ''
+
+#
+# Settings snapshot
+#
+# Settings are read from the underlying settings object (anything with get() and has()) once, on first use.
+# A build holds on to the snapshot it started with; the host replaces the snapshot when the settings change.
+#
+class SettingsSnapshot(object):
+	def __init__ (self, settings):
+		self.settings = settings
+		self.values   = {}
+
+	def get (self, key, fallback_value = None):
+		if not key in self.values:
+			self.values[key] = self.settings.get(key) if self.settings.has(key) else None
+
+		value = self.values[key]
+
+		return fallback_value if value is None else value
+
+# Size of the chunks files are read in when streamed
+CHUNK_SIZE = 65536
+
+# Number of @saveto paths written to at once
+MAX_COPY_THREADS = 4
+
+# Returns a hex digest of a file's content (str or bytes)
+def content_digest (content):
+	if not isinstance(content, bytes):
+		content = content.encode('utf-8')
+
+	return hashlib.sha1(content).hexdigest()
+
+# Moves source to target, replacing target if it exists.
+# os.replace is atomic but does not exist in Python 2.
+def replace_file (source, target):
+	if hasattr(os, 'replace'):
+		os.replace(source, target)
+	else:
+		if os.name == 'nt' and os.path.exists(target):
+			os.remove(target)
+		os.rename(source, target)
+
+# Returns the path of a temporary file next to realpath, unique to this process
+def temporary_path (realpath):
+	return os.path.join(os.path.dirname(realpath), '.%s.%d.%d.tmp' % (os.path.basename(realpath), os.getpid(), next(OutputFile.temp_counter)))
+
+# Yields the contents of a file in chunks
+def read_chunks (filepath):
+	with open(filepath, 'r') as handle:
+		while True:
+			chunk = handle.read(CHUNK_SIZE)
+			if not chunk:
+				break
+			yield chunk
+
+#
+# Output file
+#
+# Everything is written to a temporary file in the target directory, which is moved
+# into place on commit(). Readers never see a half-written file.
+# A file that already has the written content is left untouched, so its mtime only changes along with its content.
+# Once committed, the content can be given to other files with copy_to().
+#
+class OutputFile(object):
+	temp_counter = itertools.count()
+
+	# (mtime, size, digest) of the files committed by this process, by realpath
+	committed = {}
+
+	def __init__ (self, realpath):
+		self.realpath  = realpath
+		self.temp_path = temporary_path(realpath)
+		self.handle    = open(self.temp_path, 'w')
+		self.hash      = hashlib.sha1()
+
+		# Where the written content is: the temporary file until committed
+		self.content_path = self.temp_path
+
+	def write (self, chunk):
+		if chunk:
+			self.handle.write(chunk)
+			self.hash.update(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+
+	def hexdigest (self):
+		return self.hash.hexdigest()
+
+	# Returns False if the file at realpath already had the written content
+	def commit (self, realpath = None):
+		if not self.handle:
+			return False
+
+		self.handle.close()
+		self.handle = None
+
+		realpath = realpath or self.realpath
+
+		if self.unchanged(realpath):
+			os.remove(self.temp_path)
+			self.content_path = realpath
+			return False
+
+		# Keep the permissions of the file we are replacing
+		if os.path.isfile(realpath):
+			shutil.copymode(realpath, self.temp_path)
+
+		replace_file(self.temp_path, realpath)
+		self.content_path = realpath
+
+		self.remember(realpath)
+
+		return True
+
+	# Gives the file at realpath the committed content, leaving it untouched if it already has it.
+	# If link is set the file is hardlinked to the committed one where possible, otherwise copied.
+	# Returns False if the file was left untouched.
+	def copy_to (self, realpath, link = False):
+		if self.unchanged(realpath):
+			return False
+
+		temp_path = temporary_path(realpath)
+		linked    = False
+
+		try:
+			if link:
+				try:
+					os.link(self.content_path, temp_path)
+					linked = True
+				except (OSError, AttributeError): # Another file system, or no hardlinks (Python 2 on Windows)
+					pass
+
+			if not linked:
+				shutil.copyfile(self.content_path, temp_path)
+
+				if os.path.isfile(realpath):
+					shutil.copymode(realpath, temp_path)
+
+			replace_file(temp_path, realpath)
+		except:
+			if os.path.exists(temp_path):
+				os.remove(temp_path)
+			raise
+
+		self.remember(realpath)
+
+		return True
+
+	def remember (self, realpath):
+		stat = os.stat(realpath)
+		self.committed[realpath] = (stat.st_mtime, stat.st_size, self.hexdigest())
+
+	# Compares the temporary file to the file at realpath. The file is only read if it was not
+	# committed by us, or has been changed since, and is of the same size.
+	def unchanged (self, realpath):
+		try:
+			stat = os.stat(realpath)
+		except OSError:
+			return False
+
+		committed = self.committed.get(realpath)
+
+		if committed and committed[:2] == (stat.st_mtime, stat.st_size):
+			return committed[2] == self.hexdigest()
+
+		return stat.st_size == os.path.getsize(self.content_path) and filecmp.cmp(realpath, self.content_path, shallow = False)
+
+	def discard (self):
+		if not self.handle:
+			return
+
+		self.handle.close()
+		self.handle = None
+
+		try:
+			os.remove(self.temp_path)
+		except OSError:
+			pass
+
+#
+# Streaming equivalent of str.strip(). Leading whitespace is dropped until the first
+# non-whitespace character, trailing whitespace is held back until more content follows.
+# The number of linebreaks that comes with a chunk (see ImportReceiver) is kept up to date by
+# counting the ones in the whitespace only.
+#
+class Trimmer(object):
+	def __init__ (self):
+		self.started          = False
+		self.pending          = ''
+		self.pending_newlines = 0
+
+	# Returns the trimmed chunk and the number of linebreaks in it
+	def feed (self, chunk, newlines = 0):
+		if not self.started:
+			stripped = chunk.lstrip()
+			if not stripped:
+				return '', 0
+			newlines -= chunk.count('\n', 0, len(chunk) - len(stripped))
+			chunk = stripped
+			self.started = True
+
+		stripped = chunk.rstrip()
+
+		if not stripped:
+			self.pending += chunk
+			self.pending_newlines += newlines
+			return '', 0
+
+		held = chunk.count('\n', len(stripped))
+
+		chunk, self.pending = self.pending + stripped, chunk[len(stripped):]
+		newlines, self.pending_newlines = self.pending_newlines + newlines - held, held
+
+		return chunk, newlines
+
+# Indentation of nested imports is carried down as one prefix and inserted after every linebreak where the
+# content is produced, instead of re-indenting the whole expansion again at every level.
+def indent_text (text, prefix):
+	return text.replace('\n', '\n' + prefix) if prefix else text
+
+# indent_text(), along with the number of linebreaks in the text, see ImportReceiver
+def indent_chunk (text, prefix):
+	return indent_text(text, prefix), text.count('\n')
+
+# Pairs chunks with the number of linebreaks in them, see ImportReceiver
+def count_newlines (chunks):
+	for chunk in chunks:
+		yield chunk, chunk.count('\n')
+
+# Replaces the prefix inserted by indent_text with another
+def reindent_text (text, prefix, new_prefix):
+	if prefix == new_prefix:
+		return text
+
+	return text.replace('\n' + prefix, '\n' + new_prefix)
+
+def reindent_chunks (chunks, prefix, new_prefix):
+	if prefix == new_prefix:
+		for chunk in chunks:
+			yield chunk
+		return
+
+	pending = ''
+
+	for chunk in chunks:
+		chunk = pending + chunk
+
+		# The prefix following the last linebreak may continue in the next chunk; hold both back until then
+		cut = chunk.rfind('\n')
+
+		if cut != -1 and len(chunk) - cut - 1 < len(prefix):
+			chunk, pending = chunk[:cut], chunk[cut:]
+		else:
+			pending = ''
+
+		yield reindent_text(chunk, prefix, new_prefix)
+
+	if pending:
+		yield reindent_text(pending, prefix, new_prefix)
+
+#
+# Expansion frames
+#
+# A file being expanded, see Concatenator.traverse. The file's program (Concatenator.expand) yields what the file
+# is made of, in order:
+#
+#     (CHUNK_BODY, (chunk, newlines))     content of the file itself, which is trimmed and captured (see ExpansionBody)
+#     (CHUNK_OUTER, (chunk, newlines))    its header and footer, or a reused body, which are not
+#     (CHUNK_IMPORT, (child_file_dict, referer_file_dict, receiver, prefix))    a file to expand in place
+#
+# newlines is the number of linebreaks in the chunk, counted once where the chunk is made, see ImportReceiver.
+#
+# Chunks are then written to the file's output, if it has one, and passed on to the receiver of the @import the
+# file was imported by, after which they are body chunks of the importing file. Small chunks are gathered and
+# passed on together when there are CHUNK_SIZE of them, or when the file is done: a file nested deeply does not
+# have every one of its chunks handled again at every level above it.
+#
+CHUNK_BODY   = 0
+CHUNK_OUTER  = 1
+CHUNK_IMPORT = 2
+
+class ExpansionFrame(object):
+	def __init__ (self, parent, receiver):
+		self.parent   = parent
+		self.receiver = receiver
+		self.program  = None
+		self.trimmer  = None # Trims the body, see Trimmer
+		self.body     = None # Captures the body, see ExpansionBody
+		self.writer   = None # Writes the file to disc, see OutputWriter
+		self.parts    = []   # Chunks gathered to pass on
+		self.size     = 0
+		self.newlines = 0
+
+	# Gathers a chunk to pass on. Returns the chunks to pass on now, in order, as (chunk, newlines).
+	def gather (self, chunk, newlines):
+		if len(chunk) >= CHUNK_SIZE:
+			return self.flush() + [(chunk, newlines)]
+
+		self.parts.append(chunk)
+		self.size += len(chunk)
+		self.newlines += newlines
+
+		return self.flush() if self.size >= CHUNK_SIZE else []
+
+	# Returns the chunks gathered so far, joined
+	def flush (self):
+		if not self.parts:
+			return []
+
+		passed = (''.join(self.parts), self.newlines)
+		self.parts    = []
+		self.size     = 0
+		self.newlines = 0
+
+		return [passed]
+
+#
+# Receives the expanded files of one @import: indents the first chunk with the indentation of the @import-line,
+# counts the size of the files and notes whether anything was imported at all.
+# The size is counted without the indentation given by the importing files, which follows every linebreak; the
+# linebreaks come counted with the chunk instead of counting them again at every level.
+#
+class ImportReceiver(object):
+	def __init__ (self, indentation, prefix):
+		self.indentation = indentation
+		self.prefix      = prefix
+		self.bytes       = 0
+		self.spliced     = False
+
+	def feed (self, chunk, newlines):
+		self.bytes += len(chunk) - newlines * len(self.prefix)
+
+		if not self.spliced:
+			self.spliced = True
+			return self.indentation + chunk
+
+		return chunk
+
+#
+# Writes the content of a parent to its first output while it is produced, without the carried indentation.
+# See Concatenator.commit_outputs
+#
+class OutputWriter(object):
+	def __init__ (self, output_file_dict, trim, prefix, profiler):
+		self.realpath  = output_file_dict['realpath']
+		self.output    = OutputFile(output_file_dict['output_realpath'])
+		self.trimmer   = Trimmer() if trim else None
+		self.prefix    = prefix
+		self.profiler  = profiler
+		self.bytes     = 0
+		self.committed = False
+
+	def feed (self, chunk):
+		output_text = reindent_text(chunk, self.prefix, '')
+
+		if self.trimmer:
+			output_text = self.trimmer.feed(output_text)[0]
+
+		if self.profiler:
+			start = clock()
+			self.output.write(output_text)
+			self.profiler.add_time(self.realpath, 'write', clock() - start)
+			self.bytes += len(output_text)
+		else:
+			self.output.write(output_text)
+
+	# Moves the output into place. Returns whether its content changed, see OutputFile.commit
+	def commit (self):
+		start = clock()
+		changed = self.output.commit()
+		self.committed = True
+
+		if self.profiler:
+			self.profiler.add(self.realpath, 'write', start, clock())
+
+		return changed
+
+	def discard (self):
+		if not self.committed:
+			self.output.discard()
+
+#
+# Expansion cache
+#
+# Least recently used expanded bodies, kept in memory for the lifetime of the plugin and shared by all builds.
+# Bodies are stored by the digest of their content; the dependency graph knows which body belongs to which file.
+#
+class ExpansionCache(object):
+	def __init__ (self, max_size):
+		self.max_size = max_size
+		self.size     = 0
+		self.entries  = OrderedDict()
+
+	# Larger bodies are not worth flushing the rest of the cache for
+	def entry_limit (self):
+		return self.max_size // 4
+
+	def has (self, digest):
+		return digest in self.entries
+
+	def get (self, digest):
+		content = self.entries.pop(digest, None)
+
+		if content is not None:
+			self.entries[digest] = content
+
+		return content
+
+	def put (self, digest, content):
+		if digest in self.entries or len(content) > self.entry_limit():
+			return
+
+		self.entries[digest] = content
+		self.size += len(content)
+
+		while self.size > self.max_size:
+			self.size -= len(self.entries.popitem(last = False)[1])
+
+	def resize (self, max_size):
+		self.max_size = max_size
+
+		while self.size > self.max_size:
+			self.size -= len(self.entries.popitem(last = False)[1])
+
+expansion_cache = None
+
+# Returns the shared expansion cache, or None if it is disabled
+def get_expansion_cache (max_size):
+	global expansion_cache
+
+	if not max_size or not OrderedDict:
+		expansion_cache = None
+	elif expansion_cache is None:
+		expansion_cache = ExpansionCache(max_size)
+	else:
+		expansion_cache.resize(max_size)
+
+	return expansion_cache
+
+#
+# The body of an expansion while it is produced. It is captured in memory for the
+# expansion cache, as long as it fits, and/or streamed to disc.
+# Only bodies stored in the dependency graph are hashed, see hexdigest.
+#
+class ExpansionBody(object):
+	def __init__ (self, memory_limit, output, hashed = True):
+		self.parts        = [] if memory_limit else None
+		self.size         = 0
+		self.memory_limit = memory_limit
+		self.output       = output
+		self.hash         = hashlib.sha1() if hashed else None
+
+	def write (self, chunk):
+		if not chunk:
+			return
+
+		if self.hash:
+			self.hash.update(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+
+		if self.parts is not None:
+			self.size += len(chunk)
+
+			if self.size > self.memory_limit:
+				self.parts = None
+			else:
+				self.parts.append(chunk)
+
+		if self.output:
+			self.output.write(chunk)
+
+	def hexdigest (self):
+		return self.hash.hexdigest()
+
+	# The captured content, or None if it did not fit in memory
+	def content (self):
+		if self.parts is None:
+			return None
+
+		if len(self.parts) != 1:
+			self.parts = [''.join(self.parts)]
+
+		return self.parts[0]
+
+	def discard (self):
+		self.parts = None
+
+		if self.output:
+			self.output.discard()
+
+#
+# Stat cache
+#
+# Every path is stat'ed at most once per run; existence checks, file sizes and modification times
+# all come from the same os.stat result. Failed stats are cached as well and raised again.
+# Whatever else DirectoryIndex may only reuse within the run is kept here as well, and goes with it.
+#
+class StatCache(object):
+	def __init__ (self):
+		self.stats    = {}
+		self.hits     = 0
+		self.misses   = 0
+		self.listings = {} # Directory listings too recent to reuse in later runs, see DirectoryIndex.listing
+		self.globs    = {} # (matches, listed directories) by pattern, see DirectoryIndex.glob
+
+	def stat (self, path):
+		if path in self.stats:
+			self.hits += 1
+		else:
+			self.misses += 1
+
+			try:
+				self.stats[path] = os.stat(path)
+			except OSError as exc:
+				self.stats[path] = exc
+
+		result = self.stats[path]
+
+		if isinstance(result, OSError):
+			raise result
+
+		return result
+
+	# Records a stat made elsewhere, e.g. when the file was read
+	def put (self, path, stat):
+		self.stats[path] = stat
+
+	def isfile (self, path):
+		try:
+			return S_ISREG(self.stat(path).st_mode)
+		except OSError:
+			return False
+
+	def getsize (self, path):
+		return self.stat(path).st_size
+
+	def getmtime (self, path):
+		return self.stat(path).st_mtime
+
+# Characters that make a path a glob pattern
+re_glob_magic = re.compile(r'[*?[]')
+
+# Separators of path parts
+re_path_separator = re.compile(r'[\\/]' if os.altsep else re.escape(os.sep))
+
+# Returns the parts of an absolute path, the first being its root ('/', 'C:\\')
+def split_path (path):
+	drive, path = os.path.splitdrive(path)
+
+	return [drive + os.sep] + [part for part in re_path_separator.split(path) if part]
+
+# Returns the sorted names of the entries in a directory, the set of those that are directories,
+# and the set of those directories that are symbolic links
+def list_directory (dirname):
+	names = []
+	dirs  = set()
+	links = set()
+
+	if scandir:
+		for entry in scandir(dirname):
+			names.append(entry.name)
+
+			try:
+				if entry.is_dir():
+					dirs.add(entry.name)
+
+					if entry.is_symlink():
+						links.add(entry.name)
+			except OSError:
+				pass
+	else:
+		for name in os.listdir(dirname):
+			names.append(name)
+			path = os.path.join(dirname, name)
+
+			if os.path.isdir(path):
+				dirs.add(name)
+
+				if os.path.islink(path):
+					links.add(name)
+
+	names.sort()
+
+	return names, dirs, links
+
+# Returns True if path matches the glob pattern, see DirectoryIndex.glob
+def match_glob (path, pattern):
+	def match (parts, pattern_parts):
+		if not pattern_parts:
+			return not parts
+
+		if pattern_parts[0] == '**':
+			# The last ** matches files only
+			if len(pattern_parts) == 1:
+				return len(parts) > 0
+
+			return any(match(parts[index:], pattern_parts[1:]) for index in range(len(parts)))
+
+		return len(parts) > 0 and fnmatch.fnmatch(parts[0], pattern_parts[0]) and match(parts[1:], pattern_parts[1:])
+
+	return match(split_path(os.path.abspath(path)), split_path(os.path.abspath(pattern)))
+
+#
+# Directory index
+#
+# Answers the patterns of glob: imports from directory listings that are kept for the lifetime of the plugin
+# and shared by all builds, instead of listing the same directories for every pattern. A listing is used
+# as long as the mtime of its directory is unchanged; every directory is stat'ed at most once per build.
+#
+# Patterns are matched like glob.glob does, and ** matches any number of directories. Results are sorted by name,
+# the matches in a directory coming before those in the directories below it.
+#
+class DirectoryIndex(object):
+	# Directories changed less than this many seconds before they were listed may change again within the
+	# same mtime on file systems with a coarse one. Their listings are only used for the build that listed them.
+	RACY_SECONDS = 2
+
+	def __init__ (self):
+		self.listings = {}
+
+	# Returns the (names, visible names, dirs, links) of a directory, see list_directory, or None if it can not be listed.
+	# stat_cache is the StatCache of the current build, listed a set collecting the directories looked at.
+	def listing (self, dirname, stat_cache, listed):
+		listed.add(dirname)
+
+		try:
+			mtime = stat_cache.stat(dirname).st_mtime
+		except OSError:
+			return None
+
+		listing = stat_cache.listings.get(dirname) or self.listings.get(dirname)
+
+		if listing and listing[0] == mtime:
+			return listing[1]
+
+		try:
+			names, dirs, links = list_directory(dirname)
+		except OSError:
+			return None
+
+		# Like glob, wildcards do not match hidden files
+		listing = (names, [name for name in names if not name.startswith('.')], dirs, links)
+
+		if time.time() - mtime < self.RACY_SECONDS:
+			stat_cache.listings[dirname] = (mtime, listing)
+		else:
+			self.listings[dirname] = (mtime, listing)
+
+		return listing
+
+	# Returns the sorted paths matching an absolute pattern. Patterns are only matched once per build.
+	def glob (self, pattern, stat_cache, listed = None):
+		result = stat_cache.globs.get(pattern)
+
+		if not result:
+			directories = set()
+			result = stat_cache.globs[pattern] = (self.match(pattern, stat_cache, directories), directories)
+
+		if listed is not None:
+			listed.update(result[1])
+
+		return list(result[0])
+
+	def match (self, pattern, stat_cache, listed):
+		parts = split_path(os.path.abspath(pattern))
+		paths = [parts[0]]
+		last  = len(parts) - 1
+
+		for index in range(1, len(parts)):
+			part    = parts[index]
+			matches = []
+
+			for path in paths:
+				if part == '**':
+					self.walk(path, stat_cache, listed, index == last, matches)
+				elif not re_glob_magic.search(part):
+					# Plain names are not looked up in the listing, they may differ in case from the actual name.
+					# The directory is still tracked: the name may only be created later.
+					listed.add(path)
+					matches.extend(self.exists(os.path.join(path, part), stat_cache, index == last))
+				else:
+					listing = self.listing(path, stat_cache, listed)
+
+					if listing:
+						names, visible, dirs, links = listing
+						prefix = path if path.endswith(os.sep) else path + os.sep
+
+						matches.extend([prefix + name for name in fnmatch.filter(names if part.startswith('.') else visible, part) if index == last or name in dirs])
+
+			paths = matches
+
+		unique = set()
+
+		return [path for path in paths if not (path in unique or unique.add(path))]
+
+	# Returns [path] if it exists, and is a directory unless is_last
+	def exists (self, path, stat_cache, is_last):
+		try:
+			stat = stat_cache.stat(path)
+		except OSError:
+			return []
+
+		return [path] if is_last or S_ISDIR(stat.st_mode) else []
+
+	# Appends the directory and all directories below it to matches, or all files below it if is_last.
+	# Symbolically linked directories are not descended into, they could link back up the tree.
+	def walk (self, dirname, stat_cache, listed, is_last, matches):
+		listing = self.listing(dirname, stat_cache, listed)
+
+		if not listing:
+			return
+
+		names, visible, dirs, links = listing
+		prefix = dirname if dirname.endswith(os.sep) else dirname + os.sep
+
+		if is_last:
+			matches.extend([prefix + name for name in visible if not name in dirs])
+		else:
+			matches.append(dirname)
+
+		for name in visible:
+			if name in dirs and not name in links:
+				self.walk(prefix + name, stat_cache, listed, is_last, matches)
+
+directory_index = DirectoryIndex()
+
+#
+# Profiler
+#
+# Per-file timings of a build: reading, scanning for methods, rendering templates and writing,
+# together with the bytes read and written and the number of reused expansions.
+# Shown as a table in the verbose dialog and optionally written as a Chrome trace.
+#
+class Profiler(object):
+	PHASES = ['read', 'scan', 'template', 'write']
+
+	# Rows shown in the table, slowest files first
+	MAX_ROWS = 25
+
+	def __init__ (self):
+		self.start   = clock()
+		self.end     = None
+		self.files   = {}
+		self.order   = []
+		self.events  = []
+		self.threads = {}
+
+	def file (self, realpath):
+		entry = self.files.get(realpath)
+
+		if entry is None:
+			entry = self.files[realpath] = {'read': 0.0, 'scan': 0.0, 'template': 0.0, 'write': 0.0, 'bytes_in': 0, 'bytes_out': 0, 'reused': 0}
+			self.order.append(realpath)
+
+		return entry
+
+	# Adds a phase, timed with clock(), to the file. thread is the ident of the thread it ran on, if not the current one.
+	def add (self, realpath, phase, start, end, thread = None):
+		self.file(realpath)[phase] += end - start
+		self.events.append((phase, realpath, start, end, thread or threading.current_thread().ident))
+
+	# Adds time to the file without a trace event, for phases spread over many small calls
+	def add_time (self, realpath, phase, seconds):
+		self.file(realpath)[phase] += seconds
+
+	def count (self, realpath, key, amount = 1):
+		self.file(realpath)[key] += amount
+
+	def total (self, entry):
+		return sum(entry[phase] for phase in self.PHASES)
+
+	# Returns the table of the slowest files, paths relative to base_dir
+	def table (self, base_dir, format_bytes):
+		def relative (realpath):
+			try:
+				return os.path.relpath(realpath, base_dir)
+			except ValueError: # Another drive
+				return realpath
+
+		def row (total, entry, name):
+			return '%8.1f %8.1f %8.1f %8.1f %8.1f %10s %10s %6d  %s' % (
+				total * 1000, entry['read'] * 1000, entry['scan'] * 1000, entry['template'] * 1000, entry['write'] * 1000,
+				format_bytes(entry['bytes_in']), format_bytes(entry['bytes_out']), entry['reused'], name)
+
+		paths = sorted(self.order, key = lambda realpath: -self.total(self.files[realpath]))
+		lines = ['%8s %8s %8s %8s %8s %10s %10s %6s  %s' % ('total', 'read', 'scan', 'template', 'write', 'in', 'out', 'reused', 'file')]
+
+		for realpath in paths[:self.MAX_ROWS]:
+			lines.append(row(self.total(self.files[realpath]), self.files[realpath], relative(realpath)))
+
+		if len(paths) > self.MAX_ROWS:
+			lines.append('... and ' + str(len(paths) - self.MAX_ROWS) + ' more files')
+
+		totals = dict((key, sum(entry[key] for entry in self.files.values())) for key in self.PHASES + ['bytes_in', 'bytes_out', 'reused'])
+		lines.append(row(self.total(totals), totals, 'all ' + str(len(paths)) + ' files'))
+
+		return 'Profile (milliseconds, build took ' + "{0:.2f}".format((self.end or clock()) - self.start) + ' seconds):\n' + '\n'.join(lines)
+
+	# Returns the events in the Trace Event Format, as read by chrome://tracing and Perfetto
+	def trace (self):
+		def event (name, start, end, thread, args):
+			return {'name': name, 'ph': 'X', 'pid': 1, 'tid': self.threads.setdefault(thread, len(self.threads) + 1),
+				'ts': (start - self.start) * 1000000, 'dur': (end - start) * 1000000, 'args': args}
+
+		events = [event('build', self.start, self.end or clock(), threading.current_thread().ident, {})]
+		events.extend(event(phase, start, end, thread, {'file': realpath}) for phase, realpath, start, end, thread in self.events)
+
+		return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+#
+# Dependency graph
+#
+# Persists every parsed file (keyed by realpath) together with its stat, content hash and
+# @import/@partof/@saveto edges. Expanded bodies of imported files are stored next to the graph so
+# that a file whose whole subtree is unchanged does not have to be read or parsed again.
+# Bodies of leaves (files importing nothing) are only kept in memory; reading them from disc is no quicker than reading the files.
+#
+class DependencyGraph(object):
+	VERSION = 4
+
+	# Number of different expansions (setting-fingerprints and source files) we keep per file
+	MAX_EXPANSIONS = 8
+
+	def __init__ (self, cache_dir):
+		self.cache_dir  = cache_dir
+		self.graph_file = os.path.join(cache_dir, 'dependency_graph.json')
+		self.bodies_dir = os.path.join(cache_dir, 'bodies')
+		self.nodes      = {}
+		self.dirty      = False
+		self.checked    = {}
+		self.memory     = None
+		self.on_disk    = True
+		self.stat_cache = None
+
+		self.load()
+
+	def load (self):
+		try:
+			with open(self.graph_file, 'r') as handle:
+				data = json.load(handle)
+		except (IOError, OSError, ValueError):
+			return
+
+		if data.get('version') == self.VERSION:
+			self.nodes = data.get('nodes', {})
+
+	def save (self):
+		if not self.dirty:
+			return
+
+		if not os.path.isdir(self.bodies_dir):
+			os.makedirs(self.bodies_dir)
+
+		# Written atomically; a build reading the graph meanwhile sees either the old or the new one
+		output = OutputFile(self.graph_file)
+		output.write(json.dumps({'version': self.VERSION, 'nodes': self.nodes}))
+		output.commit()
+
+		# Remove bodies no longer referenced by any expansion
+		referenced = set()
+		for node in self.nodes.values():
+			for expansion in node.get('expansions', {}).values():
+				referenced.add(expansion['body'])
+
+		for body in os.listdir(self.bodies_dir):
+			if body not in referenced:
+				try:
+					os.remove(os.path.join(self.bodies_dir, body))
+				except OSError:
+					pass
+
+		self.dirty = False
+
+	# Must be called before each run; validation results are only valid for one run.
+	# Bodies are kept in the memory cache (an ExpansionCache or None) and, if on_disk, in the cache directory.
+	# Files are stat'ed through the run's StatCache.
+	def begin_run (self, memory, on_disk, stat_cache):
+		self.checked    = {}
+		self.memory     = memory
+		self.on_disk    = on_disk
+		self.stat_cache = stat_cache
+
+	# Records a file after it has been parsed. Any earlier expansions are dropped if the content changed.
+	def update_node (self, realpath, stat, digest, imports, partofs, savetos):
+		node = self.nodes.get(realpath)
+
+		if not node or node['hash'] != digest or node['imports'] != imports:
+			node = self.nodes[realpath] = {'expansions': {}}
+
+		node['mtime']   = stat.st_mtime
+		node['size']    = stat.st_size
+		node['hash']    = digest
+		node['imports'] = imports
+		node['partofs'] = partofs
+		node['savetos'] = savetos
+
+		self.checked.pop(realpath, None)
+		self.dirty = True
+
+	# Returns a digest of a file and everything it imports, or None if any of them changed since they were
+	# recorded. Computed once per run.
+	def subtree_digest (self, realpath):
+		if realpath in self.checked:
+			return self.checked[realpath]
+
+		# Depth first without recursion, import chains can be deeper than the recursion limit.
+		# A path is on the stack twice: before its imports are checked, and after.
+		stack   = [realpath]
+		pending = set()
+
+		while stack:
+			path = stack[-1]
+
+			if not path in self.checked:
+				# Guards against import cycles
+				self.checked[path] = None
+
+				node = self.unchanged_node(path)
+
+				if node is None:
+					stack.pop()
+					continue
+
+				pending.add(path)
+				stack.extend([child for edge in node['imports'] for child in reversed(edge['paths']) if not child in self.checked])
+			elif path in pending:
+				stack.pop()
+				pending.discard(path)
+
+				node  = self.nodes[path]
+				parts = [node['hash']]
+
+				for edge in node['imports']:
+					if 'glob' in edge:
+						if directory_index.glob(edge['glob'], self.stat_cache) != edge['matches']:
+							parts = None
+							break
+						parts.append(edge['matches'])
+
+					digests = [self.checked.get(child) for child in edge['paths']]
+
+					if None in digests:
+						parts = None
+						break
+
+					parts.extend(digests)
+
+				self.checked[path] = parts and content_digest(json.dumps(parts))
+			else:
+				stack.pop()
+
+		return self.checked[realpath]
+
+	# Returns the node of a file if the file did not change since, otherwise None
+	def unchanged_node (self, realpath):
+		node = self.nodes.get(realpath)
+		if not node:
+			return None
+
+		try:
+			stat = self.stat_cache.stat(realpath)
+		except OSError:
+			return None
+
+		if stat.st_mtime != node['mtime'] or stat.st_size != node['size']:
+			# Touched, but maybe not changed
+			try:
+				with open(realpath, 'r') as handle:
+					digest = content_digest(handle.read())
+			except (IOError, OSError):
+				return None
+
+			if digest != node['hash']:
+				return None
+
+			node['mtime'] = stat.st_mtime
+			node['size']  = stat.st_size
+			self.dirty = True
+
+		return node
+
+	# Returns True if the file has a stored expansion whose body is at hand, see get_expansion
+	def has_expansions (self, realpath):
+		for expansion in self.nodes.get(realpath, {}).get('expansions', {}).values():
+			if (self.on_disk and expansion['is_parent']) or (self.memory and self.memory.has(expansion['body'])):
+				return True
+
+		return False
+
+	# Returns the first stored expansion under any of the keys if the file and its whole subtree is unchanged,
+	# otherwise None. The body is available as an iterable of chunks under 'chunks'.
+	def get_expansion (self, realpath, keys):
+		node = self.nodes.get(realpath)
+
+		if not node:
+			return None
+
+		for key in keys:
+			if not key in node['expansions']:
+				continue
+
+			expansion = node['expansions'][key]
+
+			if expansion['subtree'] != self.subtree_digest(realpath):
+				return None
+
+			content = self.memory and self.memory.get(expansion['body'])
+
+			if content is not None:
+				return dict(expansion, chunks = [content])
+
+			body_file = os.path.join(self.bodies_dir, expansion['body'])
+
+			if self.on_disk and expansion['is_parent'] and os.path.isfile(body_file):
+				return dict(expansion, chunks = read_chunks(body_file))
+
+		return None
+
+	# Returns the number of bytes of a body that can be kept in the memory cache
+	def memory_limit (self):
+		return self.memory.entry_limit() if self.memory else 0
+
+	# Returns an OutputFile to stream the body of an expansion to, see ExpansionBody. None if bodies are not kept on disc.
+	def open_body_file (self):
+		if not self.on_disk:
+			return None
+
+		if not os.path.isdir(self.bodies_dir):
+			os.makedirs(self.bodies_dir)
+
+		return OutputFile(os.path.join(self.bodies_dir, 'body'))
+
+	# indentation is the prefix the body was indented with, see indent_text. uses_source is whether the body
+	# rendered any {{source.*}} variables, stored expansions of its own children included.
+	def store_expansion (self, realpath, key, body_output, is_parent, indentation, uses_source, options, referenced, referenced_bytes):
+		node = self.nodes.get(realpath)
+		subtree = self.subtree_digest(realpath)
+
+		if not node or subtree is None:
+			return body_output.discard()
+
+		# Bodies are stored by their digest
+		body = body_output.hexdigest()
+		content = body_output.content() if self.memory and body_output.size <= self.memory.entry_limit() else None
+
+		if self.memory and content is not None:
+			self.memory.put(body, content)
+
+		if body_output.output:
+			body_file = os.path.join(self.bodies_dir, body)
+
+			if os.path.isfile(body_file):
+				body_output.output.discard()
+			else:
+				body_output.output.commit(body_file)
+
+		# Without a copy on disc, a body the memory cache did not take can not be reused
+		elif not (self.memory and self.memory.has(body)):
+			return
+
+		expansions = node['expansions']
+
+		if not key in expansions and len(expansions) >= self.MAX_EXPANSIONS:
+			expansions.pop(sorted(expansions, key = lambda existing: expansions[existing]['time'])[0])
+
+		expansions[key] = {
+			'body':             body,
+			'subtree':          subtree,
+			'time':             time.time(),
+			'is_parent':        is_parent,
+			'indentation':      indentation,
+			'uses_source':      uses_source,
+			'options':          options,
+			'referenced':       referenced,
+			'referenced_bytes': referenced_bytes
+		}
+
+		self.dirty = True
+
+# The graph is loaded lazily and kept for the lifetime of the plugin
+dependency_graph = None
+
+def get_dependency_graph (cache_dir):
+	global dependency_graph
+
+	if dependency_graph is None or dependency_graph.cache_dir != cache_dir:
+		dependency_graph = DependencyGraph(cache_dir)
+
+	return dependency_graph
+
+# Finds the methods by their name alone; much cheaper than Concatenator.re_method on files without any
+re_method_name = re.compile(r'@(?:import|partof|option|saveto)', re.IGNORECASE)
+
+# Returns the Concatenator.re_method matches in content
+def find_methods (content):
+	if not re_method_name.search(content):
+		return []
+
+	return list(Concatenator.re_method.finditer(content))
+
+# Files larger than this are scanned for methods in chunks, and streamed into the output if they have none
+PASSTHROUGH_SIZE = CHUNK_SIZE * 16
+
+# Reads a file and scans it for methods. Runs on the threads of the Prefetcher.
+# Large files without methods are not kept in memory; their 'content' is None and 'passthrough' is set.
+# The time spent is recorded under 'timings' as (phase, start, end, thread), see Profiler.
+def read_source (realpath):
+	source = {'stat': None, 'content': '', 'error': None, 'passthrough': False, 'timings': []}
+	thread = threading.current_thread().ident
+	start  = clock()
+
+	try:
+		source['stat'] = os.stat(realpath)
+
+		if source['stat'].st_size > PASSTHROUGH_SIZE and scan_passthrough(realpath, source):
+			source['timings'].append(('read', start, clock(), thread))
+			return source
+
+		with open(realpath, 'r') as handle:
+			source['content'] = handle.read()
+	except (IOError, OSError) as exc:
+		source['stat']  = None
+		source['error'] = exc
+
+	source['digest']  = content_digest(source['content'])
+	scan_start        = clock()
+	source['matches'] = find_methods(source['content'])
+
+	source['timings'].append(('read', start, scan_start, thread))
+	source['timings'].append(('scan', scan_start, clock(), thread))
+
+	return source
+
+# Hashes a file chunk by chunk, giving up as soon as a method name is found. Returns True if there was none.
+def scan_passthrough (realpath, source):
+	digest = hashlib.sha1()
+	tail   = ''
+
+	for chunk in read_chunks(realpath):
+		# Also look for names spanning the previous chunk and this one
+		if re_method_name.search(tail + chunk[:7]) or re_method_name.search(chunk):
+			return False
+
+		digest.update(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+		tail = chunk[-7:]
+
+	source['content']     = None
+	source['digest']      = digest.hexdigest()
+	source['matches']     = []
+	source['passthrough'] = True
+
+	return True
+
+#
+# Prefetcher
+#
+# Reads files ahead of the (sequential) parser on a bounded thread pool. Paths are prefetched in the order
+# they will be parsed; the most recently prefetched batch goes first since the parser works depth first.
+# At most max_workers * 2 files are held at once. Every prefetched path must be either get() or discard()ed.
+#
+class Prefetcher(object):
+	def __init__ (self, read, max_workers):
+		self.read     = read
+		self.results  = {}
+		self.queue    = collections.deque()
+		self.queued   = set()
+		self.window   = max_workers * 2
+		self.executor = ThreadPoolExecutor(max_workers) if ThreadPoolExecutor and max_workers > 1 else None
+
+	def prefetch (self, realpaths):
+		if not self.executor:
+			return
+
+		realpaths = [realpath for realpath in realpaths if not realpath in self.queued and not realpath in self.results]
+
+		self.queue.extendleft(reversed(realpaths))
+		self.queued.update(realpaths)
+		self.fill()
+
+	def fill (self):
+		while self.queue and len(self.results) < self.window:
+			realpath = self.queue.popleft()
+
+			if realpath in self.queued:
+				self.queued.discard(realpath)
+				self.results[realpath] = self.executor.submit(self.read, realpath)
+
+	def discard (self, realpath):
+		self.queued.discard(realpath)
+		future = self.results.pop(realpath, None)
+
+		if future:
+			future.cancel()
+			self.fill()
+
+	# Returns the result of read(realpath), waiting for it if it is being read
+	def get (self, realpath):
+		self.queued.discard(realpath)
+		future = self.results.pop(realpath, None)
+		self.fill()
+
+		return future.result() if future else self.read(realpath)
+
+	def close (self):
+		if self.executor:
+			for future in self.results.values():
+				future.cancel()
+
+			self.executor.shutdown(wait = False)
+
+# Raised inside a build when a newer build of the same file has been requested
+class BuildCancelled(Exception):
+	pass
+
+#
+# Build queue
+#
+# Runs builds one at a time on a background thread. Builds are keyed by the file they start from:
+# submitting a key that is already waiting replaces the waiting build, and submitting the key that
+# is currently building cancels it (the newer build is queued as usual).
+#
+class BuildQueue(object):
+	def __init__ (self):
+		self.condition = threading.Condition()
+		self.pending   = []
+		self.jobs      = {}
+		self.running   = None
+		self.thread    = None
+
+	# job is called with a threading.Event which is set when the build should be cancelled
+	def submit (self, key, job):
+		with self.condition:
+			if self.running and self.running[0] == key:
+				self.running[1].set()
+
+			if not key in self.jobs:
+				self.pending.append(key)
+
+			self.jobs[key] = job
+
+			if not self.thread or not self.thread.is_alive():
+				self.thread = threading.Thread(target = self.work, name = 'FileConcatenator')
+				self.thread.daemon = True
+				self.thread.start()
+
+			self.condition.notify_all()
+
+	def cancel_all (self):
+		with self.condition:
+			del self.pending[:]
+			self.jobs.clear()
+
+			if self.running:
+				self.running[1].set()
+
+	# Blocks until all submitted builds have finished
+	def join (self):
+		with self.condition:
+			while self.pending or self.running:
+				self.condition.wait()
+
+	def work (self):
+		while True:
+			with self.condition:
+				while not self.pending:
+					self.condition.wait()
+
+				key = self.pending.pop(0)
+				job = self.jobs.pop(key)
+				self.running = (key, threading.Event())
+				cancel_event = self.running[1]
+
+			try:
+				job(cancel_event)
+			except Exception:
+				traceback.print_exc()
+			finally:
+				with self.condition:
+					self.running = None
+					self.condition.notify_all()
+
+build_queue = BuildQueue()
+
+#
+# Reverse index
+#
+# Knows which files @import which, for every file in the project folders. Built by scanning the folders once
+# and kept up to date as files are saved, so that saving an imported file can rebuild the files importing it.
+#
+class ReverseIndex(object):
+	def __init__ (self):
+		self.scanned   = None
+		self.imports   = {}
+		self.importers = {}
+		self.globs     = {}
+
+	# Scans the folders unless they (and the extensions) are the ones scanned last time
+	def scan (self, folders, extensions):
+		scanned = (sorted(folders), sorted(extensions))
+
+		if scanned == self.scanned:
+			return
+
+		self.scanned   = scanned
+		self.imports   = {}
+		self.importers = {}
+		self.globs     = {}
+
+		for folder in folders:
+			for dirpath, dirnames, filenames in os.walk(folder):
+				# Skip .git, .svn etc
+				dirnames[:] = [dirname for dirname in dirnames if not dirname.startswith('.')]
+
+				for filename in filenames:
+					if filename.split('.')[-1] in extensions:
+						self.update(os.path.join(dirpath, filename))
+
+	# (Re)reads the @import's of a file
+	def update (self, realpath):
+		realpath = os.path.abspath(realpath)
+
+		for child in self.imports.pop(realpath, []):
+			self.importers.get(child, set()).discard(realpath)
+
+		self.globs.pop(realpath, None)
+
+		try:
+			with open(realpath, 'r') as handle:
+				content = handle.read()
+		except (IOError, OSError, UnicodeDecodeError):
+			return
+
+		imports = []
+		globs   = []
+
+		for match in find_methods(content):
+			if match.group(4).lower() != 'import':
+				continue
+
+			value = match.group(5).strip('\'" ')
+
+			if value.startswith('glob:'):
+				globs.append(os.path.abspath(os.path.join(os.path.dirname(realpath), value[5:])))
+			else:
+				imports.append(os.path.abspath(os.path.join(os.path.dirname(realpath), value)))
+
+		self.imports[realpath] = imports
+
+		for child in imports:
+			self.importers.setdefault(child, set()).add(realpath)
+
+		if globs:
+			self.globs[realpath] = globs
+
+	# Returns the files directly importing realpath
+	def parents (self, realpath):
+		parents = set(self.importers.get(realpath, ()))
+
+		for parent, patterns in self.globs.items():
+			for pattern in patterns:
+				if match_glob(realpath, pattern):
+					parents.add(parent)
+
+		return parents
+
+	# Returns the files that import realpath, directly or through other files, and are not imported themselves
+	def roots (self, realpath):
+		realpath = os.path.abspath(realpath)
+		roots    = set()
+		visited  = set([realpath])
+		queue    = [realpath]
+
+		while queue:
+			for parent in self.parents(queue.pop()):
+				if parent in visited:
+					continue
+
+				visited.add(parent)
+
+				if self.parents(parent):
+					queue.append(parent)
+				else:
+					roots.add(parent)
+
+		return sorted(roots)
+
+reverse_index = ReverseIndex()
+
+# Returns the files a build read or looked for, and their directories (for glob:'s and files yet to be created).
+# The files it wrote are left out.
+def result_paths (result):
+	paths = set([result['source_file_dict']['realpath']])
+	paths.update([file_dict['realpath'] for file_dict in result['referenced_file_dicts'] + result['written_file_dicts']])
+	paths.update([missing_file[0]['realpath'] for missing_file in result['missing_children'] + result['missing_parents']])
+	paths.update([os.path.dirname(path) for path in paths])
+	paths.update(result['glob_directories'])
+	paths.difference_update([file_dict['output_realpath'] for file_dict in result['written_file_dicts']])
+
+	return paths
+
+#
+# Build manifest
+#
+# Written to the host's cache directory after a build without problems: the settings the build read, the files it read
+# and the directories it listed for glob:'s, and the outputs it wrote. The next build of the file is skipped if none
+# of them changed, see Concatenator.current_manifest. The 'key' identifies the inputs regardless of their
+# modification times, e.g. as a cache key on a build server.
+#
+MANIFEST_VERSION = 2
+
+# The manifest of the builds of realpath, or None if there is no cache directory to keep it in
+def manifest_path (cache_dir, realpath):
+	if not cache_dir:
+		return None
+
+	return os.path.join(cache_dir, 'manifests', content_digest(realpath) + '.json')
+
+# The digest read_source gives a file
+def file_digest (realpath):
+	digest = hashlib.sha1()
+
+	for chunk in read_chunks(realpath):
+		digest.update(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+
+	return digest.hexdigest()
+
+# Identifies the names glob: can match in a directory listing (see DirectoryIndex.listing)
+def listing_digest (listing):
+	return content_digest(json.dumps(sorted(listing[1]))) if listing else None
+
+#
+# Watcher
+#
+# Polls the files the roots depend on and rebuilds the roots whose files changed. Changes are collected
+# until a poll finds none, and at least `debounce` seconds have passed since the last one; a burst of
+# changes (e.g. a git checkout) causes one build per affected root.
+#
+class Watcher(object):
+	# build(root) builds a root and returns the paths it depends on, see result_paths
+	def __init__ (self, build, interval = 0.5, debounce = 0.3):
+		self.build      = build
+		self.interval   = interval
+		self.debounce   = debounce
+		self.watched    = {}
+		self.snapshots  = {}
+		self.stop_event = threading.Event()
+
+	# Files are compared by mtime and size, directories by the names in them
+	def snapshot (self, path):
+		try:
+			stat = os.stat(path)
+		except OSError:
+			return None
+
+		if not S_ISDIR(stat.st_mode):
+			return (stat.st_mtime, stat.st_size, None)
+
+		previous = self.snapshots.get(path)
+
+		if previous and previous[0] == stat.st_mtime:
+			return previous
+
+		try:
+			return (stat.st_mtime, None, sorted(os.listdir(path)))
+		except OSError:
+			return None
+
+	def changed (self, previous, current):
+		if previous is None or current is None:
+			return previous != current
+
+		if current[2] is None:
+			return previous[:2] != current[:2]
+
+		return previous[2] != current[2]
+
+	# Returns the watched paths that changed since the last poll
+	def poll (self):
+		changed = set()
+
+		for path in set().union(*self.watched.values()):
+			snapshot = self.snapshot(path)
+
+			if self.changed(self.snapshots.get(path), snapshot):
+				changed.add(path)
+
+			self.snapshots[path] = snapshot
+
+		return changed
+
+	def rebuild (self, roots):
+		for root in roots:
+			self.watched[root] = set(self.build(root)) | set([root])
+
+			# What the build itself changed is not a change
+			for path in self.watched[root]:
+				self.snapshots[path] = self.snapshot(path)
+
+	def run (self, roots):
+		self.rebuild(roots)
+
+		pending = set()
+		last_change = 0
+
+		while not self.stop_event.is_set():
+			self.stop_event.wait(self.interval)
+
+			changed = self.poll()
+
+			if changed:
+				pending |= changed
+				last_change = time.time()
+			elif pending and time.time() - last_change >= self.debounce:
+				affected = [root for root in sorted(self.watched) if self.watched[root] & pending]
+				pending = set()
+
+				self.rebuild(affected)
+
+	def stop (self):
+		self.stop_event.set()
+
+#
+# Concatenator
+#
+# Parses a file, and everything it references, and writes the result to disc.
+#
+# Todo:
+#   "Brand" output-file to prevent bad overwrites?
+#   Add "Increment output file", up to x pieces of them. 0 = don't increment, always overwrite
+#   Warn about @(unknown_setting_key, value)
+# 
+# BUGS
+class Concatenator(object):
+	re_template = re.compile(r''' 
+		(?P<outermatch>
+			{{
+			(?P<namespace>\w+)
+			.
+			(?P<key>\w+)
+			}}
+		)
+	''', re.VERBOSE | re.IGNORECASE)
+
+	# We'll use the exact same regex for matching @imports and @partofs to keep it concistent.
+	re_method = re.compile(r'''
+		(\r\n|\n)?                  # Match any linebreak zero or on time
+		(                           # Full replace part
+			([ \t]*)                # Capture any whitespace or tab (intendation)
+			(?://|\#|\/\*)?         # Non-capture any possible beginning of comment
+			(?:[ \t]*)              # Non-capture any possible whitespace
+			@(import|partof|option|saveto) # Match method
+			(?:[ \t|url])*           # Non-capture whitespace or 'url'
+			\(([^\)]+)\)            # Match "(" and capture everything up until ")"
+			(?:\;|\*/)?             # Non-capture ending comment, or end of line, 
+		)
+		(\r\n|\n)?                   # Match any linebreak zero or one time
+	''', re.VERBOSE | re.IGNORECASE)
+
+	# Set while running in the background, see BuildQueue
+	cancel_event = None
+
+	# Compiled templates by their source, see compile_template. Shared by all instances, cleared when the settings change.
+	compiled_templates = {}
+
+	# The settings of the current build, see SettingsSnapshot
+	settings_snapshot = None
+
+	def __init__ (self, host):
+		self.host = host
+
+	# Function for (re)setting all instance variables.
+	# These must not live on the class; builds can run on the build queue and the main thread at the same time.
+	def reset_instance (self):
+		self.jit_scopes 			= []
+		self.log_list 				= collections.deque(maxlen = LOG_RECORD_LIMIT)
+		self.log_dropped 			= 0
+
+		self.log_list_types 		= {}
+		self.log_list_types[1] 		= 0 # Info
+		self.log_list_types[2] 		= 0 # Warning
+		self.log_list_types[3] 		= 0 # Error
+		self.log_list_types[4] 		= 0 # Fatal
+
+		# Number of {{source.*}} template variables rendered
+		self.source_lookups 		= 0
+
+		self.stat_cache 			= StatCache()
+
+		self.settings_snapshot 		= self.host.settings()
+
+		# Info's are only ever displayed in the verbose dialog, and along with the profile
+		self.log_infos 				= bool(self.setting(0, 'verbose') or self.setting(0, 'profile'))
+
+	# The logging method used throughout the plugin.
+	# If args are given the message is formatted with them, but only when the log is displayed (see format_log_entry)
+	def log (self, msg_type, message, file_dict = 0, *args):
+		self.log_list_types[msg_type] += 1
+
+		if msg_type == MSG_TYPE['INFO'] and not self.log_infos:
+			return
+
+		if len(self.log_list) == LOG_RECORD_LIMIT:
+			self.log_dropped += 1
+
+		self.log_list.append(LogRecord(msg_type, message, args, file_dict['filename'] if file_dict else ''))
+
+	def format_log_entry (self, log_entry):
+		msg_type, message, args, filename = log_entry
+
+		message = (message % args) if args else str(message)
+		prefix  = (filename + ', ') if filename else ''
+
+		if msg_type == MSG_TYPE['INFO']:
+			return prefix + 'INFO: ' + message
+
+		if msg_type == MSG_TYPE['WARNING']:
+			prefix += 'WARNING: '
+		elif msg_type == MSG_TYPE['ERROR']:
+			prefix += 'ERROR: '
+		elif msg_type == MSG_TYPE['FATAL']:
+			prefix += 'FATAL: '
+
+		return '\n' + prefix + message + '\n'
+
+	# JIT-settings are scoped to the file they are pushed in. A scope is entered when a file is parsed and left
+	# when it is done. Recursive settings are inherited by the scopes of the file's children; the dict holding
+	# them is shared until a scope pushes or clears a recursive setting of its own.
+	def enter_jit_scope (self, file_dict):
+		inherited = self.jit_scopes[-1]['recursive'] if self.jit_scopes else {}
+
+		self.jit_scopes.append({'realpath': file_dict['realpath'], 'settings': {}, 'recursive': inherited, 'shared': True})
+
+	def leave_jit_scope (self):
+		self.jit_scopes.pop()
+
+	# Returns the dict of JIT-settings to modify in the current scope
+	def jit_scope_settings (self, recursive):
+		scope = self.jit_scopes[-1]
+
+		if not recursive:
+			return scope['settings']
+
+		if scope['shared']:
+			scope['recursive'] = dict(scope['recursive'])
+			scope['shared'] = False
+
+		return scope['recursive']
+
+	# Non-recursive settings only apply to the file of the current scope, recursive ones also to its children
+	def get_jit_setting (self, key, file_dict):
+		if not file_dict or not self.jit_scopes:
+			return
+
+		scope = self.jit_scopes[-1]
+
+		if key in scope['settings'] and scope['realpath'] == file_dict['realpath']:
+			return scope['settings'][key]
+
+		return scope['recursive'].get(key)
+
+	def push_jit_setting (self, key, value, recursive, file_dict = 0):
+		if not file_dict:
+			return
+
+		settings = self.jit_scope_settings(recursive)
+
+		if key in settings:
+			self.log(MSG_TYPE['INFO'], 'Overwrote JIT-setting {"%s": "%s", recursive="%s"}, {"%s": "%s", recursive="%s"}', file_dict, key, settings[key], recursive, key, value, recursive)
+		else:
+			self.log(MSG_TYPE['INFO'], 'Pushed JIT-setting {"%s": "%s", recursive="%s"}', file_dict, key, value, recursive)
+
+		settings[key] = value
+
+	def clear_jit_setting (self, key, recursive, file_dict = 0):
+		if not file_dict:
+			return
+
+		settings = self.jit_scope_settings(recursive)
+
+		if not key in settings:
+			self.log(MSG_TYPE['WARNING'], 'Tried to clear non-existing JIT-setting "%s"', file_dict, key)
+		elif recursive:
+			self.log(MSG_TYPE['INFO'], 'Cleared recursive JIT-setting "%s"', file_dict, key)
+			settings.pop(key)
+		else:
+			self.log(MSG_TYPE['INFO'], 'Cleared non-recursive JIT-setting "%s"', file_dict, key)
+			settings.pop(key)
+
+	# Applies an @option(key, value, recursive) in the current scope
+	def apply_jit_option (self, key, value, recursive, file_dict):
+		if value.lower() == 'default':
+			self.clear_jit_setting(key, recursive, file_dict)
+		else:
+			self.push_jit_setting(key, value, recursive, file_dict)
+
+	# A helper function to retrieve the behaviour of this plugin.
+	# Returns a JIT-setting if available, otherwise one from the build's settings snapshot
+	def setting (self, file_dict, key, fallback_value = False):
+		jit_setting = self.get_jit_setting(key, file_dict)
+
+		if not jit_setting == None:
+			return jit_setting
+
+		return (self.settings_snapshot or self.host.settings()).get(key, fallback_value)
+
+	# A helper function for formatting size
+	def format_bytes (self, bytes):
+		for unit in ['B', 'KB', 'MB', 'GB']:
+			if bytes < 1024.0:
+				return '%3.1f %s' % (bytes, unit)
+			bytes /= 1024.0
+		return '%3.1f %s' % (bytes, 'TB')
+
+
+	def parse_string_literals (self, string):
+		return (
+			string
+				.replace('\\\\', '{!~db~!}') 	# Temporarily rename escaped \\ backslashes
+				.replace('\\\'', "'") 			# Single quote (')
+				.replace('\\\"', '"') 			# Double quote (")
+				.replace('\\a', '\a') 			# ASCII Bell (BEL)
+				.replace('\\b', '\b') 			# ASCII Backspace (BS)
+				.replace('\\f', '\f') 			# ASCII Formfeed (FF)
+				.replace('\\n', '\n') 			# ASCII Linefeed (LF)
+				.replace('\\r', '\r') 			# ASCII Carriage Return (CR)
+				.replace('\\t', '\t') 			# ASCII Horizontal Tab (TAB)
+				.replace('\\v', '\v') 			# ASCII Vertical Tab (VT)
+				.replace('{!~db~!}', '\\') 		# Revert escaped backslashes
+		)
+
+	def get_path_info (self, path, working_dir = ''):
+		info = {}
+
+		# Convert to absolute path if needed
+		if not os.path.isabs(path):
+			info['dirname'] = os.path.abspath(os.path.join(working_dir, path))
+		else:
+			info['dirname'] = path
+
+		info['dirname']     = os.path.dirname(info['dirname'])                   # (C:\source)\file.js
+		info['filename']    = os.path.basename(path)                             # C:\source\(file.js)
+		split               = os.path.splitext(info['filename'])
+		info['fileroot']    = split[0]                                          # C:\source\(file).js
+		info['extension']   = split[1][1:]                                      # C:\source\file.(js)
+		info['realpath']    = os.path.join(info['dirname'], info['filename'])    # (C:\source\file.js)
+		info['working_dir'] = working_dir                                       # As specified in the argument. The directory to start from.
+		info['is_child'] 	= True
+
+		return info
+
+	# Splits a template into (literal, namespace, key) segments, where namespace and key are None for plain text.
+	# Escape sequences are processed here, once, instead of every time the template is rendered.
+	def compile_template (self, string):
+		segments = self.compiled_templates.get(string)
+
+		if segments is None:
+			segments = []
+			position = 0
+
+			for tpl_match in re.finditer(self.re_template, string):
+				if tpl_match.start() > position:
+					segments.append((self.parse_string_literals(string[position:tpl_match.start()]), None, None))
+
+				# The literal is used as is if the variable has no value
+				segments.append((self.parse_string_literals(tpl_match.group('outermatch')), tpl_match.group('namespace'), tpl_match.group('key')))
+				position = tpl_match.end()
+
+			if position < len(string):
+				segments.append((self.parse_string_literals(string[position:]), None, None))
+
+			# Templates can be changed by @option; don't let the cache grow forever
+			if len(self.compiled_templates) >= 256:
+				self.compiled_templates.clear()
+
+			self.compiled_templates[string] = segments
+
+		return segments
+
+	def template (self, file_dict, string, valueDict):
+		if not string:
+			return string
+
+		parts = []
+
+		for literal, namespace, key in self.compile_template(string):
+			if namespace is None:
+				parts.append(literal)
+				continue
+
+			value = self.template_value(file_dict, namespace, key, valueDict)
+
+			# If we got a value, replace the {{template_var}} with the value
+			parts.append(literal if value == False else value)
+
+		return ''.join(parts)
+
+	# Returns the value of {{namespace.key}}, or False if there is none
+	def template_value (self, file_dict, namespace, key, valueDict):
+		value = False
+
+		# (source/target/referer).*
+		if namespace == 'this' or namespace == 'source' or namespace == 'referer':
+			owner = valueDict[namespace]
+
+			# Expansions using the source can not be shared with other source files
+			if namespace == 'source':
+				self.source_lookups += 1
+
+			if key in owner:
+				value = owner[key]
+
+			# The file is stat'ed once per concatenation, no matter how many of these are used (see StatCache)
+			elif key == 'filesize':
+				value = str(self.format_bytes(self.stat_cache.getsize(owner['realpath'])))
+			elif key == 'lastmod_date':
+				value = time.strftime(self.setting(file_dict, 'date_format'), time.gmtime(self.stat_cache.getmtime(owner['realpath'])))
+			elif key == 'lastmod_time':
+				value = time.strftime(self.setting(file_dict, 'time_format'), time.gmtime(self.stat_cache.getmtime(owner['realpath'])))
+			else:
+				self.log(MSG_TYPE['WARNING'], 'Unknown template key "%s"', file_dict, key)
+
+		# system.*
+		elif namespace == 'system':
+			if key == 'time':
+				value = time.strftime(self.setting(file_dict, 'time_format'))
+			elif key == 'date':
+				value = time.strftime(self.setting(file_dict, 'date_format'))
+			elif key == 'platform':
+				value = self.host.platform()
+			elif key == 'arch':
+				value = self.host.arch()
+			elif key == 'version':
+				value = self.host.version()
+			else:
+				self.log(MSG_TYPE['WARNING'], 'Unknown template key "%s"', file_dict, key)
+
+		# result.*
+		elif namespace == 'result':
+			owner = valueDict[namespace]
+			tmp = 0
+			display_x_files = 3
+
+			if key == 'num_referenced_files':
+				tmp = len(owner['referenced_file_dicts'])
+				value = str(tmp) + (' files' if tmp > 1 else ' file')
+			elif key == 'referenced_files_size':
+				value = self.format_bytes(owner['referenced_file_bytes'])
+			elif key == 'written_filenames':
+				tmp = len(owner['written_file_dicts'])
+				value = ', '.join(["'" + fdict['output_filename'] + "'" for fdict in owner['written_file_dicts'][:display_x_files]])
+				value += (' and ' + str(tmp - display_x_files) + ' more') if tmp > display_x_files else ''
+			elif key == 'referenced_filenames':
+				tmp = len(owner['referenced_file_dicts'])
+				value = ', '.join(["'" + fdict['filename'] + "'" for fdict in owner['referenced_file_dicts'][:display_x_files]])
+				value += (' and ' + str(tmp - display_x_files) + ' more') if tmp > display_x_files else ''
+			elif key == 'runtime':
+				value = "{0:.2f}".format(owner['runtime_end'] - owner['runtime_start'])
+			elif key == 'num_reused_files':
+				value = str(owner['num_reused_files'])
+			else:
+				self.log(MSG_TYPE['WARNING'], 'Unknown template key "%s"', file_dict, key)
+
+		# ?.*
+		else:
+			self.log(MSG_TYPE['WARNING'], 'Unknown namespace key "%s"', file_dict, namespace)
+
+		return value
+
+	# Resolves the output file for target_file_dict.
+	# Returns the output_file_dict, or False if it may not be written.
+	def open_output (self, source_file_dict, target_file_dict, referer_file_dict, saveto_file_dict = False):
+		filename = saveto_file_dict['filename'] if saveto_file_dict else ''
+		dirname  = saveto_file_dict['dirname'] if saveto_file_dict else target_file_dict['dirname']
+
+		output_filename = filename if filename else self.setting(target_file_dict, 'tpl_output_filename')
+		output_filename = self.template(target_file_dict, output_filename, {
+			'this':     target_file_dict,
+			'source':   source_file_dict,
+			'referer':  referer_file_dict
+		})
+
+		# The absolute path to the output file
+		output_realpath = os.path.join(dirname, output_filename)
+
+		# Safety net
+		if not saveto_file_dict and os.path.isfile(output_realpath) and target_file_dict['filename'] == output_filename:
+			self.log(MSG_TYPE['FATAL'], 'A file already exist at the path specified and the name equals to the original. I will not continue at risk of overwriting the original.\n\nEvaluated filename:\n%s\n\nDirectory:\n%s\n\nPlease look over your settings.', target_file_dict, output_filename, target_file_dict['dirname'])
+			return False
+
+		output_file_dict = dict(target_file_dict)
+		output_file_dict['output_filename'] = output_filename
+		output_file_dict['output_dirname']  = dirname
+		output_file_dict['output_realpath'] = output_realpath
+
+		return output_file_dict
+
+	# Moves the output written by writer (see OutputWriter) into place and copies it to the other outputs (see open_output).
+	# Every output gets the same content.
+	def commit_outputs (self, writer, output_file_dicts, memo):
+		changed = [writer.commit()]
+		changed.extend(self.copy_output(writer.output, output_file_dicts[1:], memo))
+
+		for output_file_dict, output_changed in zip(output_file_dicts, changed):
+			if not output_changed:
+				self.log(MSG_TYPE['INFO'], 'Output unchanged, left untouched: %s', output_file_dict, output_file_dict['output_realpath'])
+
+			if memo['profiler']:
+				memo['profiler'].count(output_file_dict['realpath'], 'bytes_out', writer.bytes)
+
+			memo['written_file_dicts'].append(output_file_dict)
+			memo['written_outputs'].setdefault(output_file_dict['realpath'], output_file_dict['output_realpath'])
+			memo['output_digests'][output_file_dict['output_realpath']] = (output_file_dict['realpath'], writer.output.hexdigest())
+
+	# Copies a committed output to more @saveto paths, in parallel. Returns whether each of them changed, see OutputFile.copy_to
+	def copy_output (self, output_file, output_file_dicts, memo):
+		if not output_file_dicts:
+			return []
+
+		link = self.setting(output_file_dicts[0], 'saveto_hardlinks')
+
+		def copy (output_file_dict):
+			start = clock()
+			changed = output_file.copy_to(output_file_dict['output_realpath'], link)
+
+			return changed, start, clock(), threading.current_thread().ident
+
+		if ThreadPoolExecutor and len(output_file_dicts) > 1:
+			executor = ThreadPoolExecutor(min(len(output_file_dicts), MAX_COPY_THREADS))
+
+			try:
+				results = list(executor.map(copy, output_file_dicts))
+			finally:
+				executor.shutdown()
+		else:
+			results = [copy(output_file_dict) for output_file_dict in output_file_dicts]
+
+		if memo['profiler']:
+			for output_file_dict, (changed, start, end, thread) in zip(output_file_dicts, results):
+				memo['profiler'].add(output_file_dict['realpath'], 'write', start, end, thread)
+
+		return [changed for changed, start, end, thread in results]
+
+	# Returns the (start, end) span to cut when removing a method-match.
+	# Prioritize the succeeding linebreak, then the preceding
+	def removal_span (self, match):
+		if match.group(6):
+			return match.start(2), match.end(6)
+
+		return (match.start(1) if match.group(1) else match.start(2)), match.end(2)
+
+	# Returns the rendered header or footer (part is 'header' or 'footer') of a parsed file, and the number of linebreaks in it
+	def wrapper (self, part, target_file_dict, referer_file_dict, memo, is_parent, prefix = ''):
+		template = self.setting(target_file_dict, 'tpl_' + ('parent' if is_parent else 'child') + '_' + part)
+
+		if not template:
+			return '', 0
+
+		values = {'this': target_file_dict, 'source': memo['source_file_dict'], 'referer': referer_file_dict}
+
+		return indent_chunk(self.render_template(target_file_dict, template, values, memo), prefix)
+
+	# template(), timed when profiling
+	def render_template (self, file_dict, string, values, memo):
+		if not memo['profiler']:
+			return self.template(file_dict, string, values)
+
+		start  = clock()
+		result = self.template(file_dict, string, values)
+		memo['profiler'].add(file_dict['realpath'], 'template', start, clock())
+
+		return result
+
+	# Identifies everything besides the files themselves that the expansion of a file depends on.
+	# Returns the key for expansions that are the same for every source file, and the key for those that
+	# used {{source.*}} in their templates.
+	def expansion_keys (self, file_dict, memo):
+		values = [self.setting(file_dict, key) for key in OUTPUT_SETTING_KEYS]
+		fingerprint = content_digest(json.dumps(values))
+
+		return fingerprint, content_digest(json.dumps([fingerprint, memo['source_file_dict']['realpath']]))
+
+	# Runs the program of a file (see expand) and the programs of everything it imports. The files being expanded
+	# are kept on a stack instead of the call stack, innermost last, so imports can be nested as deep as they like.
+	def traverse (self, target_file_dict, referer_file_dict, memo):
+		frame = ExpansionFrame(None, None)
+		frame.program = self.expand(frame, target_file_dict, referer_file_dict, memo)
+		stack = [frame]
+
+		try:
+			while stack:
+				frame = stack[-1]
+
+				try:
+					kind, value = next(frame.program)
+				except StopIteration:
+					stack.pop()
+
+					# The importing file continues with everything of this one passed on
+					for chunk, newlines in frame.flush():
+						self.pass_on(frame.parent, CHUNK_BODY, frame.receiver.feed(chunk, newlines), newlines)
+
+					continue
+
+				if kind == CHUNK_IMPORT:
+					child_file_dict, child_referer_file_dict, receiver, prefix = value
+
+					child = ExpansionFrame(frame, receiver)
+					child.program = self.expand(child, child_file_dict, child_referer_file_dict, memo, prefix)
+					stack.append(child)
+					continue
+
+				chunk, newlines = value
+				self.pass_on(frame, kind, chunk, newlines)
+		finally:
+			# Unwinds the files still being expanded, if any, so they discard their unfinished outputs
+			for frame in reversed(stack):
+				frame.program.close()
+
+	# Trims, captures and writes a chunk of a file (see ExpansionFrame), then passes it on to the files importing it
+	# for as long as they have gathered enough to pass on themselves
+	def pass_on (self, frame, kind, chunk, newlines):
+		pending = [(frame, kind, chunk, newlines)]
+
+		while pending:
+			frame, kind, chunk, newlines = pending.pop()
+
+			if kind == CHUNK_BODY:
+				if frame.trimmer:
+					chunk, newlines = frame.trimmer.feed(chunk, newlines)
+
+				if frame.body:
+					frame.body.write(chunk)
+
+			if not chunk:
+				continue
+
+			if frame.writer:
+				frame.writer.feed(chunk)
+
+			if frame.receiver:
+				chunks = [(frame.receiver.feed(passed, count), count) for passed, count in frame.gather(chunk, newlines)]
+
+				# Each chunk goes all the way up before the next one
+				pending.extend([(frame.parent, CHUNK_BODY, passed, count) for passed, count in reversed(chunks)])
+
+	# Yields the content of a file (see expand) with the method-matches either removed or replaced with the expanded children.
+	# splices is a list of (match, child_file_dict, globsearch), where child_file_dict is False for removals.
+	# prefix is the indentation carried down from the importing files.
+	def splice (self, target_file_dict, target_content, splices, graph_imports, memo, prefix):
+		position = 0
+
+		for parent_match, child_file_dict, globsearch in splices:
+			if not child_file_dict:
+				# Remove the fullmatch reference
+				cut_start, cut_end = self.removal_span(parent_match)
+				yield CHUNK_BODY, indent_chunk(target_content[position:cut_start], prefix)
+				position = cut_end
+				continue
+
+			yield CHUNK_BODY, indent_chunk(target_content[position:parent_match.start(2)], prefix)
+			position = parent_match.end(2)
+
+			# Apply indentation
+			indentation = parent_match.group(3)
+
+			if not (len(indentation) > 0 and self.setting(target_file_dict, 'apply_intendation') == True):
+				indentation = ''
+
+			receiver = ImportReceiver(indentation, prefix + indentation)
+			circular = False
+
+			# Check that we haven't already parsed and written this file to disc.
+			if child_file_dict['realpath'] in memo['written_outputs']:
+				memo['prefetcher'].discard(child_file_dict['realpath'])
+				memo['num_reused_files'] += 1
+				graph_imports.append({'paths': [child_file_dict['realpath']]})
+
+				for chunk in reindent_chunks(read_chunks(memo['written_outputs'][child_file_dict['realpath']]), '', prefix + indentation):
+					if chunk:
+						newlines = chunk.count('\n')
+						yield CHUNK_BODY, (receiver.feed(chunk, newlines), newlines)
+			else:
+
+				# Normalize the child_matches list.
+				# globsearch or not, we are gonna continue with a list of 0 or more matches 
+				if globsearch:
+					glob_matches  = directory_index.glob(child_file_dict['realpath'], self.stat_cache, memo['glob_directories'])
+					child_matches = [self.get_path_info(filematch, target_file_dict['dirname']) for filematch in glob_matches]
+					graph_imports.append({'glob': child_file_dict['realpath'], 'matches': glob_matches, 'paths': [child_dict['realpath'] for child_dict in child_matches]})
+					memo['prefetcher'].prefetch([child_dict['realpath'] for child_dict in child_matches if not (memo['graph'] and memo['graph'].has_expansions(child_dict['realpath']))])
+				else:
+					child_matches = [child_file_dict]
+					graph_imports.append({'paths': [child_file_dict['realpath']]})
+
+				imported = []
+
+				for child_dict in child_matches:
+					# A file importing itself, directly or through other files, would be expanded forever
+					if child_dict['realpath'] in memo['import_path_set']:
+						self.log(MSG_TYPE['ERROR'], 'Circular @import skipped: %s', target_file_dict, ' -> '.join(memo['import_path'] + [child_dict['realpath']]))
+						memo['prefetcher'].discard(child_dict['realpath'])
+						circular = True
+						continue
+
+					yield CHUNK_IMPORT, (child_dict, target_file_dict, receiver, prefix + indentation)
+
+					memo['referenced_file_bytes'] += receiver.bytes
+					receiver.bytes = 0
+					imported.append(child_dict)
+
+				memo['referenced_file_dicts'].extend(imported)
+
+			# glob: can yield 0 results, in which case the fullmatch is left as is
+			if not receiver.spliced and not circular:
+				yield CHUNK_BODY, indent_chunk(parent_match.group(2), prefix)
+
+		yield CHUNK_BODY, indent_chunk(target_content[position:], prefix)
+
+	# The program of a file being expanded, run by traverse(): parses the file and yields its content, header and
+	# footer included, and the children to expand in between. Parents are written to disc as their content passes through.
+	# prefix is the indentation carried down from the importing files, see indent_text.
+	def expand (self, frame, target_file_dict, referer_file_dict, memo, prefix = ''):
+		if self.cancel_event and self.cancel_event.is_set():
+			raise BuildCancelled()
+
+		# A file can be both a parent and child at the same time.
+		is_child = target_file_dict['is_child']
+		is_parent = False
+
+		graph = memo['graph']
+		expansion_keys = None
+
+		# JIT-settings pushed from here on apply to this file (and its children, if recursive) only
+		self.enter_jit_scope(target_file_dict)
+
+		memo['import_path'].append(target_file_dict['realpath'])
+		memo['import_path_set'].add(target_file_dict['realpath'])
+
+		# Reuse the expansion made earlier in this run (the file is imported more than once),
+		# or the stored expansion if neither the file nor anything it imports has changed
+		if is_child:
+			expansion_keys = self.expansion_keys(target_file_dict, memo)
+			expansion = memo['expansions'].get((target_file_dict['realpath'], expansion_keys[0]))
+
+			if not expansion and graph:
+				expansion = graph.get_expansion(target_file_dict['realpath'], expansion_keys)
+
+			if expansion:
+				memo['prefetcher'].discard(target_file_dict['realpath'])
+				memo['num_reused_files'] += 1
+				memo['referenced_file_dicts'].extend([self.get_path_info(os.path.basename(path), os.path.dirname(path)) for path in expansion['referenced']])
+				memo['referenced_file_bytes'] += expansion['referenced_bytes']
+
+				self.log(MSG_TYPE['INFO'], 'Reused unchanged expansion', target_file_dict)
+
+				if memo['profiler']:
+					memo['profiler'].count(target_file_dict['realpath'], 'reused')
+
+				# The file's own @option's still apply to its header and footer
+				for option_key, option_val, option_rec in expansion['options']:
+					self.apply_jit_option(option_key, option_val, option_rec, target_file_dict)
+
+				memo['options'][target_file_dict['realpath']] = expansion['options']
+
+				# The body is specific to the source file, and so is the body of the files importing it
+				if expansion['uses_source']:
+					self.source_lookups += 1
+
+				# The files of a stored expansion are not read again; the dependency graph knows their digests
+				for path in [target_file_dict['realpath']] + expansion['referenced']:
+					if not path in memo['input_digests']:
+						node = graph.nodes.get(path) if graph else None
+						memo['input_digests'][path] = node['hash'] if node else None
+
+						# Their glob:'s were looked up when checking the subtree, see DependencyGraph.subtree_digest;
+						# the directories listed for them are watched all the same
+						for edge in (node['imports'] if node else []):
+							if 'glob' in edge:
+								directory_index.glob(edge['glob'], self.stat_cache, memo['glob_directories'])
+
+				yield CHUNK_OUTER, self.wrapper('header', target_file_dict, referer_file_dict, memo, expansion['is_parent'], prefix)
+
+				for item in count_newlines(reindent_chunks(expansion['chunks'], expansion['indentation'], prefix)):
+					yield CHUNK_OUTER, item
+
+				yield CHUNK_OUTER, self.wrapper('footer', target_file_dict, referer_file_dict, memo, expansion['is_parent'], prefix)
+
+				self.leave_expansion(memo)
+				return
+
+		# If any of these change while parsing this file, the expansion depends on more than the file's subtree
+		reuse_guard = (len(memo['missing_children']), self.log_list_types[2], self.log_list_types[3], self.log_list_types[4])
+		num_referenced = len(memo['referenced_file_dicts'])
+		referenced_bytes = memo['referenced_file_bytes']
+
+		source = memo['prefetcher'].get(target_file_dict['realpath'])
+
+		if source['error']:
+			self.log(MSG_TYPE['FATAL'], 'Could not read file: %s', target_file_dict, source['error'])
+
+		target_stat    = source['stat']
+		target_content = source['content']
+		target_digest  = source['digest']
+		target_matches = source['matches']
+
+		if target_stat:
+			self.stat_cache.put(target_file_dict['realpath'], target_stat)
+			memo['input_digests'][target_file_dict['realpath']] = target_digest
+
+		if memo['profiler']:
+			for phase, start, end, thread in source['timings']:
+				memo['profiler'].add(target_file_dict['realpath'], phase, start, end, thread)
+
+			memo['profiler'].count(target_file_dict['realpath'], 'bytes_in', target_stat.st_size if target_stat else 0)
+
+		# The matches to splice into the content, see splice()
+		splices = []
+
+		# Edges recorded in the dependency graph
+		graph_imports = []
+		graph_partofs = []
+		graph_savetos = []
+
+		self.log(MSG_TYPE['INFO'], 'Started parsing %s', target_file_dict, 'child' if is_child else 'parent')
+
+		# Reset saveto-variables. This can be filled via the @saveto
+		saveto_file_dicts = []
+
+		# Temporary file_dict holder (gets appended to saveto_file_dicts is successful)
+		saveto_file_dict = False
+
+		# The @option's of this file, as (key, value, recursive), replayed when the expansion is reused
+		jit_options = []
+
+		# All methods but @import are handled before any content is produced,
+		# so @option applies to the whole file no matter where it is placed.
+		for parent_match in target_matches:
+			beg_linebreak, fullmatch, indentation, method, value, end_linebreak = parent_match.groups('')
+
+			# Clean the value from ' " and whitespaces
+			value = value.strip('\'" ')
+
+			# Users can prefix values with 'glob:' to activate globsearch 
+			globsearch = value.startswith('glob:')
+			if (globsearch):
+				value = value[5:] # Remove the 'glob:'-prefix 
+
+			# Handle 'partof', 'option' and 'saveto' methods
+			if method == 'partof' or method == 'option' or method == 'saveto':
+
+				if method == 'partof':
+					graph_partofs.append(self.get_path_info(value, target_file_dict['dirname'])['realpath'])
+
+				# Save all partof's and parse them later, when all import's are done
+				if not is_child and method == 'partof':
+					memo['partof_queue'].append((value, target_file_dict))
+
+				# Handle @option
+				elif method == 'option':
+					option_split = value.split(',', 2)
+					
+					if len(option_split) > 1:
+						option_key = option_split[0].strip('\'" ').lower()
+						option_val = option_split[1].strip('\'" ')
+						option_rec = option_split[2].strip('\'" ').lower() if len(option_split) > 2 else False
+
+						option_rec = option_rec == 'true' or option_rec == '1'
+
+						self.apply_jit_option(option_key, option_val, option_rec, target_file_dict)
+						jit_options.append((option_key, option_val, option_rec))
+					else:
+						self.log(MSG_TYPE['WARNING'], 'Malformed @option method: "%s"', target_file_dict, fullmatch)
+
+				# Handle @saveto
+				elif not is_child and method == 'saveto':
+					if len(value) > 0:
+
+						# If the value seems to have an extension, we'll assume the user wants us to write to a file
+						saveto_file = len(os.path.splitext(value)[1]) > 1
+
+						saveto_file_dict = self.get_path_info(value if saveto_file else os.path.join(value, 'tempname.ext'), target_file_dict['dirname'])
+						
+						if not saveto_file:
+							saveto_file_dict['filename'] = ''
+
+						# If the evaluated path does not exist, ask the user if we should create it.
+						if not os.path.isdir(saveto_file_dict['dirname']):
+							if not self.host.ok_cancel_dialog(MESSAGE_HEADER + 'The path specified via @saveto in ' + target_file_dict['filename'] + ' does no exist. Do you want me to create it?\n\nPath specified:\n' + os.path.dirname(value) + os.sep + '\n\nEvaluated:\n' + saveto_file_dict['dirname'] + os.sep):
+								saveto_file_dict = False
+							else:
+								try:
+									os.makedirs(saveto_file_dict['dirname'])
+								except OSError as exc: # Python >2.5
+									if exc.errno == errno.EEXIST and os.path.isdir(saveto_file_dict['dirname']):
+										pass
+									else:
+										self.log(MSG_TYPE['FATAL'], '%s', target_file_dict, exc)
+										saveto_file_dict = False
+										raise
+
+						# Append to lists of successful
+						if saveto_file_dict:
+							saveto_file_dicts.append(saveto_file_dict)
+							graph_savetos.append(saveto_file_dict['realpath'])
+					else:
+						self.log(MSG_TYPE['WARNING'], 'Malformed @saveto method: "%s"', target_file_dict, fullmatch)
+
+				# Remove the fullmatch reference
+				splices.append((parent_match, False, False))
+
+			# Handle the 'import' method
+			elif method == 'import':
+
+				child_file_dict = self.get_path_info(value, target_file_dict['dirname'])
+
+				# Skip if the file does not exist
+				if not globsearch and not self.stat_cache.isfile(child_file_dict['realpath']):
+					memo['missing_children'].append([child_file_dict, target_file_dict])
+					splices.append((parent_match, False, False))
+					continue
+
+				is_parent = True
+				splices.append((parent_match, child_file_dict, globsearch))
+
+		if not splices:
+			self.log(MSG_TYPE['INFO'], 'No methods found', target_file_dict)
+
+		# Read the children ahead, skipping the ones that probably can be reused from the dependency graph
+		memo['prefetcher'].prefetch([child_file_dict['realpath'] for parent_match, child_file_dict, globsearch in splices if child_file_dict and not globsearch and not (graph and graph.has_expansions(child_file_dict['realpath']))])
+
+		# We handle parents and children almost exactly the same, but the user supplied settings can differ.
+		# Instead of doing more work in the name of clarity, we'll do half with variable variables.
+		write_to_disc = is_parent and (not is_child or self.setting(target_file_dict, 'write_nested_parents'))
+		trim_type     = 'parents' if is_parent else 'children'
+
+		# Trim this file? Only the edges are looked at
+		if self.setting(target_file_dict, 'trim_' + trim_type):
+			frame.trimmer = Trimmer()
+
+		# Capture the body for later imports in this run and for the dependency graph.
+		# Bodies of leaves are only kept in memory (see DependencyGraph), large leaves are not kept at all.
+		body_output = None
+
+		if target_stat and is_child and not write_to_disc and not source['passthrough']:
+			store_in_graph = graph and (graph.memory or (is_parent and graph.on_disk))
+			body_file = graph.open_body_file() if store_in_graph and is_parent else None
+			memory_limit = max(memo['expansions_memory'], graph.memory_limit() if store_in_graph else 0)
+
+			if body_file or memory_limit:
+				body_output = ExpansionBody(memory_limit, body_file, store_in_graph)
+
+		frame.body = body_output
+
+		writer = None
+		completed = False
+
+		try:
+			# Write the file(s) as the content passes through. If there is no "saveto"`s; pass False
+			if write_to_disc:
+				outputs = [self.open_output(memo['source_file_dict'], target_file_dict, referer_file_dict, saveto_file_dict) for saveto_file_dict in (saveto_file_dicts or [False])]
+				output_file_dicts = [output_file_dict for output_file_dict in outputs if output_file_dict]
+
+				if output_file_dicts:
+					writer = OutputWriter(output_file_dicts[0], self.setting(output_file_dicts[0], 'trim_output'), prefix, memo['profiler'])
+					frame.writer = writer
+
+			yield CHUNK_OUTER, self.wrapper('header', target_file_dict, referer_file_dict, memo, is_parent, prefix)
+
+			# Number of {{source.*}} variables rendered in the body
+			source_lookups = self.source_lookups
+
+			# Large files without methods are streamed from disc, see read_source
+			if source['passthrough']:
+				for item in count_newlines(reindent_chunks(read_chunks(target_file_dict['realpath']), '', prefix)):
+					yield CHUNK_BODY, item
+			else:
+				for item in self.splice(target_file_dict, target_content, splices, graph_imports, memo, prefix):
+					yield item
+
+			source_lookups = self.source_lookups - source_lookups
+
+			yield CHUNK_OUTER, self.wrapper('footer', target_file_dict, referer_file_dict, memo, is_parent, prefix)
+
+			if writer:
+				self.commit_outputs(writer, output_file_dicts, memo)
+
+			completed = True
+		finally:
+			if not completed:
+				if body_output:
+					body_output.discard()
+				if writer:
+					writer.discard()
+
+		self.log(MSG_TYPE['INFO'], 'Finished parsing', target_file_dict)
+
+		memo['options'][target_file_dict['realpath']] = jit_options
+
+		if graph and target_stat:
+			graph.update_node(target_file_dict['realpath'], target_stat, target_digest, graph_imports, graph_partofs, graph_savetos)
+
+		reusable = reuse_guard == (len(memo['missing_children']), self.log_list_types[2], self.log_list_types[3], self.log_list_types[4])
+
+		if body_output and reusable:
+			# Bodies are only joined if they fit. Nested deeply, every level would join all of the levels below it.
+			content = body_output.content() if body_output.size <= memo['expansions_memory'] else None
+			referenced = [child_dict['realpath'] for child_dict in memo['referenced_file_dicts'][num_referenced:]] if content is not None or store_in_graph else None
+
+			# Every expansion in a run has the same source file
+			if content is not None:
+				memo['expansions_memory'] -= len(content)
+				memo['expansions'][(target_file_dict['realpath'], expansion_keys[0])] = {
+					'chunks':           [content],
+					'is_parent':        is_parent,
+					'indentation':      prefix,
+					'uses_source':      bool(source_lookups),
+					'options':          jit_options,
+					'referenced':       referenced,
+					'referenced_bytes': memo['referenced_file_bytes'] - referenced_bytes
+				}
+
+			if store_in_graph:
+				expansion_key = expansion_keys[1] if source_lookups else expansion_keys[0]
+				graph.store_expansion(target_file_dict['realpath'], expansion_key, body_output, is_parent, prefix, bool(source_lookups), jit_options, referenced, memo['referenced_file_bytes'] - referenced_bytes)
+		elif body_output:
+			body_output.discard()
+
+		self.leave_expansion(memo)
+
+	# Leaves the file entered by expand()
+	def leave_expansion (self, memo):
+		memo['import_path_set'].discard(memo['import_path'].pop())
+		self.leave_jit_scope()
+
+	def parse (self, target_file_dict, referer_file_dict, callback):
+		memo = {}
+		memo['runtime_start']           = time.time()
+		memo['written_file_dicts']      = []
+		memo['written_outputs']         = {}
+		memo['referenced_file_dicts']   = []
+		memo['referenced_file_bytes']   = 0
+		memo['partof_queue']            = []
+		memo['source_file_dict']        = target_file_dict
+		memo['missing_parents']         = []
+		memo['missing_children']        = []
+		memo['num_reused_files']        = 0
+		memo['graph']                   = get_dependency_graph(self.host.cache_dir()) if self.setting(target_file_dict, 'incremental_build') and self.host.cache_dir() else None
+		memo['prefetcher']              = Prefetcher(read_source, self.setting(target_file_dict, 'read_threads', 0))
+		memo['expansions']              = {}
+		memo['expansions_memory']       = self.setting(target_file_dict, 'cache_memory_limit', 0) * 1024 * 1024
+		memo['profiler']                = Profiler() if self.setting(target_file_dict, 'profile') else None
+		memo['glob_directories']        = set()
+		memo['import_path']             = [] # The files being expanded, outermost first
+		memo['import_path_set']         = set()
+		memo['input_digests']           = {} # Digests of the files read or reused, for the build manifest
+		memo['options']                 = {} # @option's by file, as (key, value, recursive)
+		memo['output_digests']          = {} # (realpath, digest) by output_realpath
+		memo['skipped']                 = False
+
+		graph = memo['graph']
+
+		if graph:
+			graph.begin_run(get_expansion_cache(self.setting(target_file_dict, 'cache_memory_limit', 0) * 1024 * 1024), self.setting(target_file_dict, 'cache_bodies_on_disk'), self.stat_cache)
+
+		target_file_dict['is_child'] 	= False
+		referer_file_dict['is_child'] 	= False
+
+		# Every parent is concatenated once, whatever the @partof's pointing at it
+		parsed = set([target_file_dict['realpath']])
+
+		try:
+			# The expanded content is written to disc while it is produced; nothing needs to be kept here.
+			self.traverse(target_file_dict, referer_file_dict, memo)
+
+			# Parse all the 'partof'-references, in the order they were found. Parents found meanwhile are queued as well.
+			while memo['partof_queue']:
+				value, partof_file_dict = memo['partof_queue'].pop(0)
+				parent_file_dict = self.get_path_info(value, partof_file_dict['dirname'])
+
+				parent_file_dict['is_child'] = False
+
+				if parent_file_dict['realpath'] in parsed:
+					continue
+
+				# Skip if the file does not exist
+				if not self.stat_cache.isfile(parent_file_dict['realpath']):
+					memo['missing_parents'].append([parent_file_dict, partof_file_dict])
+				else:
+					parsed.add(parent_file_dict['realpath'])
+					target_file_dict = parent_file_dict
+
+					self.traverse(parent_file_dict, partof_file_dict, memo)
+		finally:
+			memo['prefetcher'].close()
+
+		if graph:
+			graph.save()
+
+		memo['runtime_end'] = time.time()
+
+		if memo['profiler']:
+			memo['profiler'].end = clock()
+
+			if self.setting(target_file_dict, 'profile_trace'):
+				self.write_profile_trace(memo['profiler'], self.get_path_info(self.setting(target_file_dict, 'profile_trace'), memo['source_file_dict']['dirname']), target_file_dict)
+
+		self.log(MSG_TYPE['INFO'], 'Stat cache: %d hits, %d misses', target_file_dict, self.stat_cache.hits, self.stat_cache.misses)
+		self.log(MSG_TYPE['INFO'], 'Parsing finished in %.2f seconds', target_file_dict, memo['runtime_end'] - memo['runtime_start'])
+		callback(memo)
+
+	def write_profile_trace (self, profiler, trace_file_dict, file_dict):
+		output = None
+
+		try:
+			output = OutputFile(trace_file_dict['realpath'])
+			output.write(json.dumps(profiler.trace()))
+			output.commit()
+		except (IOError, OSError) as exc:
+			if output:
+				output.discard()
+			self.log(MSG_TYPE['WARNING'], 'Could not write profile trace: %s', file_dict, exc)
+		else:
+			self.log(MSG_TYPE['INFO'], 'Wrote profile trace: %s', file_dict, trace_file_dict['realpath'])
+
+	def parser_callback (self, result):
+		num_missing_parents  = len(result['missing_parents'])
+		num_missing_children = len(result['missing_children'])
+
+		# If one or more files could not be found, pop an error message
+		if num_missing_parents > 0 or num_missing_children > 0:
+			str_missing_parents = ''
+			str_missing_children = ''
+
+			# Build string for presenting missing parents
+			if num_missing_parents > 0:
+				str_missing_parents = 'Parents:\n' + ''.join([missing_file[0]['realpath'] + ', referer: ' + missing_file[1]['filename'] + '\n' for missing_file in result['missing_parents']]) + '\n\n'
+
+			# Build string for presenting missing children
+			if num_missing_children > 0:
+				str_missing_children = 'Children:\n' + ''.join([missing_file[0]['realpath'] + ', referer: '+ missing_file[1]['filename'] + '\n' for missing_file in result['missing_children']])
+
+			missing_message = MESSAGE_HEADER + str(num_missing_parents + num_missing_children) + ' referenced ' + ('files' if num_missing_children > 1 else 'file') + ' could not be found:\n\n'
+
+			# Notify user
+			self.host.error_message(missing_message + str_missing_parents + str_missing_children)
+
+		infos	 = self.log_list_types[MSG_TYPE['INFO']]
+		warnings = self.log_list_types[MSG_TYPE['WARNING']]
+		errors 	 = self.log_list_types[MSG_TYPE['ERROR']]
+		fatals 	 = self.log_list_types[MSG_TYPE['FATAL']]
+
+		message = MESSAGE_HEADER
+		message += 'The concatenation finished with '
+		message += str(warnings) + ' ' + ('warning' if warnings == 1 else 'warnings') + ', '
+		message += str(errors) + ' ' + ('error' if errors == 1 else 'errors') + ' and '
+		message += str(fatals) + ' fatal.\n\n'
+		if self.log_dropped:
+			message += '(' + str(self.log_dropped) + ' earlier messages not shown)\n\n'
+
+		message += '\n'.join([self.format_log_entry(log_entry) for log_entry in self.log_list])
+
+		if result['profiler']:
+			message += '\n\n' + result['profiler'].table(result['source_file_dict']['dirname'], self.format_bytes)
+
+		if warnings or errors or fatals:
+			self.host.error_message(message)
+		elif self.setting(0, 'verbose') and infos:
+			self.host.message_dialog(message)
+
+		if len(result['written_file_dicts']) > 0:
+			# Set status message
+			status_message = self.setting(0, 'tpl_status_message')
+
+			if status_message:
+				status_message = self.template(0, status_message, {
+					'result': result
+				})
+
+				self.host.status_message(status_message)
+	# Returns the manifest of the last build of file_dict (see manifest_path) if nothing it depends on changed since, otherwise None.
+	# Files are compared by size and mtime; their content is only hashed if their mtime changed, or could have
+	# changed unnoticed (when the file was modified shortly before the manifest was written).
+	def current_manifest (self, file_dict):
+		path = manifest_path(self.host.cache_dir(), file_dict['realpath'])
+
+		if not path:
+			return None
+
+		try:
+			with open(path, 'r') as handle:
+				manifest = json.load(handle)
+
+			written = os.stat(path).st_mtime
+		except (IOError, OSError, ValueError):
+			return None
+
+		if manifest.get('version') != MANIFEST_VERSION or manifest.get('source') != file_dict['realpath']:
+			return None
+
+		for key, value in manifest['settings'].items():
+			if json.loads(json.dumps(self.settings_snapshot.get(key))) != value:
+				return None
+
+		for realpath, entry in manifest['inputs'].items():
+			try:
+				stat = self.stat_cache.stat(realpath)
+
+				if stat.st_size != entry['size']:
+					return None
+
+				if (stat.st_mtime != entry['mtime'] or written - stat.st_mtime < DirectoryIndex.RACY_SECONDS) and file_digest(realpath) != entry['digest']:
+					return None
+			except (IOError, OSError):
+				return None
+
+		for dirname, digest in manifest['directories'].items():
+			if listing_digest(directory_index.listing(dirname, self.stat_cache, set())) != digest:
+				return None
+
+		for output_realpath, entry in manifest['outputs'].items():
+			try:
+				stat = os.stat(output_realpath)
+			except OSError:
+				return None
+
+			if stat.st_size != entry['size'] or stat.st_mtime != entry['mtime']:
+				return None
+
+		return manifest
+
+	# Writes the manifest of a finished build, see current_manifest. Builds that had any problems get none,
+	# so they are run, and their problems reported, again.
+	def write_manifest (self, result):
+		path     = manifest_path(self.host.cache_dir(), result['source_file_dict']['realpath'])
+		problems = self.log_list_types[2] + self.log_list_types[3] + self.log_list_types[4] + len(result['missing_children']) + len(result['missing_parents'])
+		settings = getattr(self.settings_snapshot, 'values', None)
+
+		if not path or problems or not result['output_digests'] or settings is None or None in result['input_digests'].values():
+			return
+
+		manifest = {
+			'version':     MANIFEST_VERSION,
+			'source':      result['source_file_dict']['realpath'],
+			'settings':    dict(settings),
+			'inputs':      {},
+			'directories': {},
+			'options':     result['options'],
+			'outputs':     {}
+		}
+
+		try:
+			for realpath, digest in result['input_digests'].items():
+				stat = self.stat_cache.stat(realpath)
+				manifest['inputs'][realpath] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'digest': digest}
+
+			for dirname in result['glob_directories']:
+				manifest['directories'][dirname] = listing_digest(directory_index.listing(dirname, self.stat_cache, set()))
+
+			for output_realpath, (realpath, digest) in result['output_digests'].items():
+				stat = os.stat(output_realpath)
+				manifest['outputs'][output_realpath] = {'source': realpath, 'size': stat.st_size, 'mtime': stat.st_mtime, 'digest': digest}
+		except OSError:
+			return
+
+		manifest['key'] = content_digest(json.dumps([manifest['settings'], sorted(result['input_digests'].items()), manifest['directories']], sort_keys = True))
+
+		output = None
+
+		try:
+			if not os.path.isdir(os.path.dirname(path)):
+				os.makedirs(os.path.dirname(path))
+
+			output = OutputFile(path)
+			output.write(json.dumps(manifest, indent = 1, sort_keys = True))
+			output.commit()
+		except (IOError, OSError):
+			if output:
+				output.discard()
+
+	# The result of a build skipped because of its manifest, with what result_paths needs
+	def manifest_result (self, manifest, file_dict):
+		written_file_dicts = []
+
+		for output_realpath, entry in sorted(manifest['outputs'].items()):
+			output_file_dict = self.get_path_info(os.path.basename(entry['source']), os.path.dirname(entry['source']))
+			output_file_dict['output_filename'] = os.path.basename(output_realpath)
+			output_file_dict['output_dirname']  = os.path.dirname(output_realpath)
+			output_file_dict['output_realpath'] = output_realpath
+			written_file_dicts.append(output_file_dict)
+
+		return {
+			'skipped':               True,
+			'source_file_dict':      file_dict,
+			'referenced_file_dicts': [self.get_path_info(os.path.basename(path), os.path.dirname(path)) for path in sorted(manifest['inputs']) if path != file_dict['realpath']],
+			'written_file_dicts':    written_file_dicts,
+			'missing_children':      [],
+			'missing_parents':       [],
+			'glob_directories':      set(manifest['directories'])
+		}
+
+	# Concatenates targetFile. If cancel_event gets set the build is abandoned, leaving all outputs untouched.
+	# Returns the result (see parse), the result of the last build if nothing changed since (see manifest_result),
+	# or None if the build was cancelled.
+	def concatenate (self, targetFile, cancel_event = None):
+		self.cancel_event = cancel_event
+
+		# 1) Has some very intermittent troubles with instance variables not resetting properly.. so we have to be quite rough here
+		self.reset_instance()
+
+		self.log(MSG_TYPE['INFO'], 'Initiating concatenation')
+
+		# Generalized dictionary used throughout the plugin for file information
+		target_file_dict = self.get_path_info(os.path.basename(targetFile), os.path.dirname(targetFile))
+
+		# Nothing to do if nothing changed since the last build
+		if self.setting(0, 'build_manifest'):
+			manifest = self.current_manifest(target_file_dict)
+
+			if manifest:
+				self.host.status_message('Nothing changed since the last concatenation of ' + target_file_dict['filename'])
+				self.reset_instance()
+
+				return self.manifest_result(manifest, target_file_dict)
+
+		results = []
+
+		# Get the ball rollin'
+		try:
+			self.parse(target_file_dict, target_file_dict, results.append)
+		except BuildCancelled:
+			pass
+
+		if results:
+			self.parser_callback(results[0])
+
+			if self.setting(0, 'build_manifest'):
+				self.write_manifest(results[0])
+
+		# See 1)
+		self.reset_instance()
+
+		return results[0] if results else None
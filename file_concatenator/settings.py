@@ -0,0 +1,80 @@
+#
+# Settings files
+#
+# Reads .sublime-settings files without Sublime Text. They are JSON, plus comments and trailing commas.
+#
+import os
+import re
+import json
+
+# The settings shipped with the plugin
+DEFAULT_SETTINGS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'FileConcatenator.sublime-settings')
+
+# Strings, or a comma followed by the end of an array or object
+re_trailing_comma = re.compile(r'("(?:\\.|[^"\\])*")|,(\s*[\]}])')
+
+# Removes // and /* */ comments and trailing commas, leaving strings alone
+def strip_json_comments (text):
+	result   = []
+	position = 0
+	length   = len(text)
+
+	while position < length:
+		char = text[position]
+
+		if char == '"':
+			end = position + 1
+
+			while end < length and text[end] != '"':
+				end += 2 if text[end] == '\\' else 1
+
+			result.append(text[position:end + 1])
+			position = end + 1
+		elif text.startswith('//', position):
+			end = text.find('\n', position)
+			position = length if end < 0 else end
+		elif text.startswith('/*', position):
+			end = text.find('*/', position + 2)
+			position = length if end < 0 else end + 2
+		else:
+			end = position
+
+			while end < length and text[end] not in '"/':
+				end += 1
+
+			# A lone slash
+			if end == position:
+				end += 1
+
+			result.append(text[position:end])
+			position = end
+
+	return re_trailing_comma.sub(lambda match: match.group(1) or match.group(2), ''.join(result))
+
+#
+# Settings
+#
+# The same get() and has() as sublime.Settings, for settings read from files.
+#
+class Settings(object):
+	def __init__ (self, values = None):
+		self.values = dict(values or {})
+
+	def get (self, key, default = None):
+		return self.values.get(key, default)
+
+	def has (self, key):
+		return key in self.values
+
+	def update (self, values):
+		self.values.update(values)
+
+# Reads the settings files in order, later files overriding earlier ones
+def load_settings (paths):
+	settings = Settings()
+
+	for path in paths:
+		with open(path, 'r') as handle:
+			settings.update(json.loads(strip_json_comments(handle.read())))
+
+	return settings
@@ -0,0 +1,6 @@
+// @partof('../test3-main.js')
++-----------------+
+|                 |
+| .hidden.js      |
+|                 |
++-----------------+
\ No newline at end of file
@@ -0,0 +1,6 @@
+// @partof('../../../test3-main.js')
++-----------------+
+|                 |
+| a/b/d.js        |
+|                 |
++-----------------+
\ No newline at end of file
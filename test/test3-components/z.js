@@ -0,0 +1,6 @@
+// @partof('../test3-main.js')
++-----------------+
+|                 |
+| z.js            |
+|                 |
++-----------------+
\ No newline at end of file
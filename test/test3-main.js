@@ -0,0 +1,6 @@
+// Every file below test3-components: the ones in a directory by name, before those in the directories below it (** also matches no directory at all).
+// So b.js, z.js, a/c.js, a/b/d.js. Names starting with a dot are left out, .hidden.js should not show up.
+@import('glob:test3-components/**/*.js')
+
+// A ** at the end matches the files below a/ in the same order: a/c.js, a/b/d.js.
+@import('glob:test3-components/a/**')
\ No newline at end of file
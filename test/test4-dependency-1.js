@@ -0,0 +1,7 @@
+// @partof('test4-main.js')
++-----------------+
+|                 |
+| dependency-1.js |
+|                 |
++-----------------+
+@import('test4-dependency-2.js')
\ No newline at end of file
@@ -0,0 +1,7 @@
+// @partof('test4-dependency-1.js')
++-----------------+
+|                 |
+| dependency-2.js |
+|                 |
++-----------------+
+@import('test4-dependency-1.js')
\ No newline at end of file
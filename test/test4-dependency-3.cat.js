@@ -0,0 +1,11 @@
+// Imports dependency-2.js, which imports dependency-1.js, which imports dependency-2.js again: that one should be left out.
++-----------------+
+|                 |
+| dependency-2.js |
+|                 |
++-----------------+
++-----------------+
+|                 |
+| dependency-1.js |
+|                 |
++-----------------+
\ No newline at end of file
@@ -0,0 +1,3 @@
+// @partof('test4-main.js')
+// Imports dependency-2.js, which imports dependency-1.js, which imports dependency-2.js again: that one should be left out.
+@import('test4-dependency-2.js')
\ No newline at end of file
@@ -0,0 +1,13 @@
+// This file and test4-dependency-3.js are @partof each other: saving either concatenates both, once each.
+// dependency-1.js imports dependency-2.js, which imports dependency-1.js again. That @import should be left out
+// and reported as "Circular @import skipped: test4-main.js -> test4-dependency-1.js -> test4-dependency-2.js -> test4-dependency-1.js".
++-----------------+
+|                 |
+| dependency-1.js |
+|                 |
++-----------------+
++-----------------+
+|                 |
+| dependency-2.js |
+|                 |
++-----------------+
\ No newline at end of file
@@ -0,0 +1,7 @@
+// @partof('test5-main.js')
++-----------------+
+|                 |
+| dependency-1.js |
+|                 |
++-----------------+
+@import('glob:test5-part-*.js')
\ No newline at end of file
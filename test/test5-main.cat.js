@@ -0,0 +1,16 @@
+// Build with "incremental_build" and "build_manifest" on, change this comment and build again: dependency-1.js is reused.
+// Then add a test5-part-3.js and build once more. It should show up below, after part-2.js.
++-----------------+
+|                 |
+| dependency-1.js |
+|                 |
++-----------------+
++-----------------+
+|                 |
+|    part-1.js    |
+|                 |
++-----------------++-----------------+
+|                 |
+|    part-2.js    |
+|                 |
++-----------------+
\ No newline at end of file
@@ -0,0 +1,6 @@
+// @partof('test5-dependency-1.js')
++-----------------+
+|                 |
+|    part-2.js    |
+|                 |
++-----------------+
\ No newline at end of file